@@ -2,15 +2,145 @@ import sims4.log
 from sims4.collections import FrozenAttributeDict
 from _sims4_collections import frozendict
 from sims4.collections import _ImmutableSlotsBase
-import sys
+import functools
+import traceback
 
+from temporal_module_injector import profiling
 from temporal_module_injector import settings
-from temporal_module_injector.factory_variants import InjectionTargetType
+from temporal_module_injector import tracing
+from temporal_module_injector.autonomy_cost_report import autonomy_cost_report
+from temporal_module_injector.factory_variants import InjectionTargetType, InjectionTiming, MergeMode, \
+    get_keyed_module_injection_target_strs, get_default_injection_timing
+from temporal_module_injector.keyed_operations import PendingKeyedOperation, order_keyed_operations, \
+    ADD as KEYED_ADD
+from temporal_module_injector.lazy_attribute import LazyInjectedAttribute
+from temporal_module_injector.module_target_trie import module_target_trie
+from temporal_module_injector.ordered_insertion import PendingInsertion, merge_ordered_insertions
+from temporal_module_injector.structural_merge import is_hashable, merge_mapping_values
+from temporal_module_injector.touched_targets import touched_targets
 
 logger = sims4.log.Logger('TemporalModuleInjector')
 
 
-def add_items_to_list(new_items):
+# Cheap always-on counters for container rebuilds. Every injection rebuilds its
+# target container (they're immutable), so many snippets injecting into the same
+# target (ex: 40 snippets each rebuilding CLUB_TRAITS) copy the whole container
+# each time. The longest chain of rebuilds on one target makes that easy to spot.
+class RebuildCounters:
+    __slots__ = ('rebuild_count', 'elements_copied', 'max_elements_copied', 'rebuilds_by_target')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.rebuild_count = 0
+        self.elements_copied = 0
+        self.max_elements_copied = 0
+        self.rebuilds_by_target = {}
+
+    def record_rebuild(self, target_key, element_count):
+        self.rebuild_count += 1
+        self.elements_copied += element_count
+        if element_count > self.max_elements_copied:
+            self.max_elements_copied = element_count
+        self.rebuilds_by_target[target_key] = self.rebuilds_by_target.get(target_key, 0) + 1
+
+    def get_longest_chain(self):
+        if not self.rebuilds_by_target:
+            return None, 0
+        target_key = max(self.rebuilds_by_target, key=self.rebuilds_by_target.get)
+        return target_key, self.rebuilds_by_target[target_key]
+
+    def get_summary(self):
+        longest_target, longest_chain = self.get_longest_chain()
+        return '{} rebuild(s), {} element(s) copied ({} avg, {} max per rebuild), longest chain: {} on {}'.format(
+            self.rebuild_count,
+            self.elements_copied,
+            self.elements_copied // self.rebuild_count if self.rebuild_count else 0,
+            self.max_elements_copied,
+            longest_chain,
+            longest_target
+        )
+
+
+rebuild_counters = RebuildCounters()
+
+# Insertions into ordered targets are queued until every snippet has loaded, so each
+# target's insertions are all merged in one pass. Once flushed, anything queued
+# later (ex: deferred injections) is merged straight away.
+class OrderedInsertionQueue:
+    __slots__ = ('pending', 'flushed')
+
+    def __init__(self):
+        # injection_target_str -> [PendingInsertion], in load order.
+        self.pending = {}
+        self.flushed = False
+
+
+_ordered_insertions = OrderedInsertionQueue()
+
+
+# Removals and replacements queued for one target. They're applied once every
+# snippet has loaded (so they also see items other snippets added), all of them
+# in a single filtering pass over the target, however many snippets queued them.
+class PendingRemoval:
+    __slots__ = ('injection_target_str', 'removed', 'replacements')
+
+    def __init__(self, injection_target_str):
+        self.injection_target_str = injection_target_str
+        # Items (or mapping keys) to drop.
+        self.removed = set()
+        # Item -> replacement item, or mapping key -> (replacement key, replacement value).
+        self.replacements = {}
+
+
+# (target owner, attr name) -> PendingRemoval, in load order.
+_pending_removals = {}
+
+
+# Adds and modify-existing operations for keyed targets (ex: BABY_DEFAULT_BASSINETS)
+# are queued until every snippet has loaded, since a modify can only find its key
+# once whichever snippet adds that key has been applied. Once flushed, anything
+# queued later (ex: deferred injections) is applied straight away.
+class KeyedOperationQueue:
+    __slots__ = ('pending', 'sequence', 'flushed')
+
+    def __init__(self):
+        # injection_target_str -> [PendingKeyedOperation], in load order.
+        self.pending = {}
+        self.sequence = 0
+        self.flushed = False
+
+    def next_sequence(self):
+        self.sequence += 1
+        return self.sequence
+
+
+_KEYED_INJECTION_TARGET_STRS = frozenset(get_keyed_module_injection_target_strs())
+_keyed_operations = KeyedOperationQueue()
+
+
+def _resolve_module_target(injection_target_str):
+    # We expect that injection target str can be formatted
+    # into module_name, class_name, and attr_name. The trie keeps
+    # a resolver per path, so the class is only looked up
+    # in sys.modules (as it exists / has been loaded in the game) once.
+    with tracing.trace_span(injection_target_str, 'resolve'):
+        resolver = module_target_trie.get_or_add(injection_target_str)
+        if resolver is None:
+            raise ValueError('Invalid module target path: {}'.format(injection_target_str))
+        return resolver.resolve()
+
+
+def _is_lazy_injection_target(injection_target_str):
+    if not settings.LAZY_INJECTION_ON:
+        return False
+    return not settings.LAZY_INJECTION_TARGETS or injection_target_str in settings.LAZY_INJECTION_TARGETS
+
+
+# target_tunings, if given, are the tuning ref targets already resolved from the
+# variant's target list and selectors (ex: for deferred entries, see snippet_tuning_class).
+def add_items_to_list(new_items, target_tunings=None):
     if not new_items.is_xml_usable_variant:
         logger.warn(
             '  new_items: {} is not supposed to be an available xml variant, ignoring its contents: {}', 
@@ -18,32 +148,67 @@ def add_items_to_list(new_items):
             new_items
         )
         return
+    if not new_items.is_allowed_injection_target():
+        return
     injection_target_type = new_items.get_injection_target_type()
     if injection_target_type == InjectionTargetType.MODULE_PATH:
         item_list = new_items.item_list
         injection_target_str = new_items.injection_target_str
+        merge_mode = getattr(new_items, 'merge_mode', MergeMode.REPLACE)
         logger.info('  {}: adding items: {}', injection_target_str, item_list)
-        # We expect that injection target str can be formatted
-        # into module_name[0], class_name[1], and attr_name[2]
-        injection_target_list = injection_target_str.split(':')
-        injection_target_module_str = injection_target_list[0]
-        injection_target_class_str = injection_target_list[1]
-        injection_target_attr_str = injection_target_list[2]
-
-        # We use sys.modules to get a reference to the given module
-        # as it exists / has been loaded in the game.
-        injection_target_class = getattr(
-            sys.modules[injection_target_module_str], 
-            injection_target_class_str
-        )
-        
+        injection_target_class, injection_target_attr_str = _resolve_module_target(injection_target_str)
+        touched_targets.record(injection_target_class, injection_target_attr_str, injection_target_str)
+
+        if injection_target_str in _KEYED_INJECTION_TARGET_STRS:
+            _queue_keyed_operation(
+                injection_target_str,
+                PendingKeyedOperation.add(item_list, merge_mode, _keyed_operations.next_sequence())
+            )
+            return
+
+        # Ordered targets are merged later, all insertions for the target in one pass.
+        insert_position = getattr(new_items, 'insert_position', None)
+        if insert_position is not None:
+            pending_insertions = _ordered_insertions.pending.setdefault(injection_target_str, [])
+            pending_insertions.append(PendingInsertion.from_insert_position(
+                item_list,
+                insert_position,
+                len(pending_insertions)
+            ))
+            if _ordered_insertions.flushed:
+                flush_ordered_insertions()
+            return
+
+        # If a lazy placeholder is already installed, the merge just joins
+        # its pending additions. Checking the class dict directly matters here,
+        # since getattr on the placeholder would materialize it.
+        existing_attr = vars(injection_target_class).get(injection_target_attr_str)
+        if isinstance(existing_attr, LazyInjectedAttribute):
+            existing_attr.add_pending(
+                functools.partial(add_list_items_by_type, item_list, injection_target_str, merge_mode=merge_mode)
+            )
+            return
+        if _is_lazy_injection_target(injection_target_str):
+            lazy_attr = LazyInjectedAttribute(
+                injection_target_class,
+                injection_target_attr_str,
+                injection_target_str,
+                getattr(injection_target_class, injection_target_attr_str)
+            )
+            lazy_attr.add_pending(
+                functools.partial(add_list_items_by_type, item_list, injection_target_str, merge_mode=merge_mode)
+            )
+            setattr(injection_target_class, injection_target_attr_str, lazy_attr)
+            return
+
         injected_result = add_list_items_by_type(
             item_list, 
             injection_target_str, 
             getattr(
                 injection_target_class, 
                 injection_target_attr_str
-            )
+            ),
+            merge_mode=merge_mode
         )
 
         # We want to use setattr to ensure that we are applying changes
@@ -59,9 +224,15 @@ def add_items_to_list(new_items):
             )
     elif injection_target_type == InjectionTargetType.TUNING_REF_ATTR:
         # This is more standard tuning injection, despite looking very vague.
-        target_tuning_list = new_items.target_tuning_list
+        # Includes any selector matches (ex: all affordances with a tag)
+        # on top of the explicitly listed target tunings.
+        with tracing.trace_span(new_items.injection_target_attr_str, 'resolve') as span_args:
+            target_tuning_list = new_items.get_target_tunings() if target_tunings is None else target_tunings
+            if span_args is not None:
+                span_args['target_count'] = len(target_tuning_list)
         item_list = new_items.item_list
         injection_target_attr_str = new_items.injection_target_attr_str
+        merge_mode = getattr(new_items, 'merge_mode', MergeMode.REPLACE)
         logger.info('  {}: adding items: {} : at attr: {}', target_tuning_list, item_list, injection_target_attr_str)
         for tun in target_tuning_list:
             if not hasattr(tun, injection_target_attr_str):
@@ -72,10 +243,14 @@ def add_items_to_list(new_items):
                     injection_target_attr_str
                 )
                 continue
+            injection_target_str = '{}:{}'.format(tun.__name__, injection_target_attr_str)
+            touched_targets.record(tun, injection_target_attr_str, injection_target_str)
+            existing_items = getattr(tun, injection_target_attr_str)
             injected_result = add_list_items_by_type(
                 item_list,
-                injection_target_attr_str,
-                getattr(tun, injection_target_attr_str)
+                injection_target_str,
+                existing_items,
+                merge_mode=merge_mode
             )
             
             if injected_result is not None:
@@ -84,6 +259,36 @@ def add_items_to_list(new_items):
                     injection_target_attr_str, 
                     injected_result
                 )
+                if isinstance(injected_result, tuple):
+                    autonomy_cost_report.record_added_ads(
+                        tun,
+                        injection_target_attr_str,
+                        existing_items,
+                        injected_result[len(existing_items):]
+                    )
+    else:
+        logger.warn(
+            '  new_items: {} tried to use invalid or unprogrammed injection_target_type: {}', 
+            new_items,  
+            injection_target_type
+        )
+
+
+def _iter_injection_targets(new_items):
+    injection_target_type = new_items.get_injection_target_type()
+    if injection_target_type == InjectionTargetType.MODULE_PATH:
+        injection_target_class, injection_target_attr_str = _resolve_module_target(new_items.injection_target_str)
+        touched_targets.record(injection_target_class, injection_target_attr_str, new_items.injection_target_str)
+        yield injection_target_class, injection_target_attr_str, new_items.injection_target_str
+    elif injection_target_type == InjectionTargetType.TUNING_REF_ATTR:
+        injection_target_attr_str = new_items.injection_target_attr_str
+        for tun in new_items.get_target_tunings():
+            if not hasattr(tun, injection_target_attr_str):
+                logger.warn('  {}: has no tunable attr: {}, skipping', tun, injection_target_attr_str)
+                continue
+            injection_target_str = '{}:{}'.format(tun.__name__, injection_target_attr_str)
+            touched_targets.record(tun, injection_target_attr_str, injection_target_str)
+            yield tun, injection_target_attr_str, injection_target_str
     else:
         logger.warn(
             '  new_items: {} tried to use invalid or unprogrammed injection_target_type: {}', 
@@ -92,8 +297,241 @@ def add_items_to_list(new_items):
         )
 
 
-def add_list_items_by_type(item_list, injection_target_str, injection_target_ref):
+def _get_pending_removal(target_owner, injection_target_attr_str, injection_target_str):
+    pending_removal = _pending_removals.get((target_owner, injection_target_attr_str))
+    if pending_removal is None:
+        pending_removal = PendingRemoval(injection_target_str)
+        _pending_removals[(target_owner, injection_target_attr_str)] = pending_removal
+    return pending_removal
+
+
+def _get_item_keys(item_list):
+    if hasattr(item_list, 'keys'):
+        return tuple(item_list.keys())
+    return tuple(item_list)
+
+
+# Removals and replacements always run once snippets finish loading, and again once
+# deferred injections finish, so DEFERRED does nothing for them. Entries that ask for
+# it, rather than just getting it as their variant's default, are rejected.
+def _is_unsupported_deferred(variant):
+    return variant.injection_timing == InjectionTiming.DEFERRED and \
+        get_default_injection_timing(type(variant)) != InjectionTiming.DEFERRED
+
+
+def remove_items_from_list(removed_items):
+    if not removed_items.is_xml_usable_variant:
+        logger.warn(
+            '  removed_items: {} is not supposed to be an available xml variant, ignoring it',
+            type(removed_items)
+        )
+        return
+    if _is_unsupported_deferred(removed_items):
+        logger.warn(
+            '  {}: removals can not be DEFERRED, ignoring them',
+            removed_items.get_injection_target_label()
+        )
+        return
+    if not removed_items.is_allowed_injection_target():
+        return
+    removed = [item for item in _get_item_keys(removed_items.item_list) if item is not None and is_hashable(item)]
+    logger.info('  {}: removing items: {}', removed_items.get_injection_target_label(), removed)
+    for target_owner, injection_target_attr_str, injection_target_str in _iter_injection_targets(removed_items):
+        _get_pending_removal(target_owner, injection_target_attr_str, injection_target_str).removed.update(removed)
+
+
+def replace_items_in_list(replaced_items, new_items):
+    if not new_items.is_xml_usable_variant or type(replaced_items) is not type(new_items):
+        logger.warn(
+            '  replaced_items: {} and new_items: {} must be the same xml usable variant, ignoring them',
+            type(replaced_items),
+            type(new_items)
+        )
+        return
+    if _is_unsupported_deferred(replaced_items) or _is_unsupported_deferred(new_items):
+        logger.warn(
+            '  {}: replacements can not be DEFERRED, ignoring them',
+            new_items.get_injection_target_label()
+        )
+        return
+    if not replaced_items.is_allowed_injection_target() or not new_items.is_allowed_injection_target():
+        return
+    replaced_keys = _get_item_keys(replaced_items.item_list)
+    if len(replaced_keys) != len(new_items.item_list):
+        logger.warn(
+            '  {}: {} item(s) to replace but {} replacement(s), every replaced item needs one replacement, '
+            'ignoring them',
+            new_items.get_injection_target_label(),
+            len(replaced_keys),
+            len(new_items.item_list)
+        )
+        return
+    if hasattr(new_items.item_list, 'items'):
+        replacement_items = tuple(new_items.item_list.items())
+        replacement_keys = tuple(new_items.item_list.keys())
+    else:
+        replacement_items = tuple(new_items.item_list)
+        replacement_keys = replacement_items
+    # Unresolved references (ex: from packs the user doesn't own) on either side
+    # leave the existing item alone rather than removing it.
+    replacements = {
+        replaced: replacement
+        for replaced, replacement, replacement_key in zip(replaced_keys, replacement_items, replacement_keys)
+        if replaced is not None and replacement_key is not None and is_hashable(replaced)
+    }
+    logger.info('  {}: replacing items: {}', new_items.get_injection_target_label(), replacements)
+    # Targets come from new_items, replaced_items only says what to look for.
+    for target_owner, injection_target_attr_str, injection_target_str in _iter_injection_targets(new_items):
+        _get_pending_removal(target_owner, injection_target_attr_str, injection_target_str).replacements.update(
+            replacements
+        )
+
+
+# One pass over the target, dropping removed items and swapping replaced ones
+# with hashed lookups. Returns None if nothing in the target matched.
+def remove_list_items_by_type(pending_removal, injection_target_ref):
+    injection_target_str = pending_removal.injection_target_str
+    removed = pending_removal.removed
+    replacements = pending_removal.replacements
+    component_type = type(injection_target_ref)
+    if component_type == tuple or component_type == frozenset:
+        changed = False
+        filtered = []
+        for item in injection_target_ref:
+            if is_hashable(item):
+                if item in removed:
+                    changed = True
+                    continue
+                if item in replacements:
+                    changed = True
+                    item = replacements[item]
+            filtered.append(item)
+        if not changed:
+            return None
+        injection_target_ref = component_type(filtered)
+    elif component_type == frozendict or component_type == FrozenAttributeDict:
+        changed = False
+        filtered = {}
+        for key, value in injection_target_ref.items():
+            if key in removed:
+                changed = True
+                continue
+            if key in replacements:
+                changed = True
+                key, value = replacements[key]
+            filtered[key] = value
+        if not changed:
+            return None
+        injection_target_ref = component_type(filtered)
+    else:
+        logger.warn(
+            '  {}: type({}) not found in generic list removal options, this usually means a new removal needs'
+            ' to be written',
+            injection_target_str, 
+            component_type
+        )
+        return None
+    rebuild_counters.record_rebuild(injection_target_str, len(injection_target_ref))
+    if settings.DEBUG_ON:
+        logger.debug('  {}: with items removed is now: {}', injection_target_str, injection_target_ref)
+    return injection_target_ref
+
+
+# Removals stay queued once applied, so the pass can run again after deferred
+# injections have added their items (ex: removing an item a deferred entry adds).
+# Running it again only rebuilds targets that have something to remove again.
+def flush_removals():
+    for (target_owner, injection_target_attr_str), pending_removal in tuple(_pending_removals.items()):
+        with profiling.profile_injection(None, pending_removal.injection_target_str):
+            logger.info(
+                '  {}: removing {} and replacing {} item(s)',
+                pending_removal.injection_target_str,
+                len(pending_removal.removed),
+                len(pending_removal.replacements)
+            )
+            injection_target_ref = getattr(target_owner, injection_target_attr_str)
+            with tracing.trace_span(pending_removal.injection_target_str, 'merge') as span_args:
+                injected_result = remove_list_items_by_type(pending_removal, injection_target_ref)
+                if span_args is not None:
+                    span_args.update(
+                        removed=len(pending_removal.removed),
+                        replacements=len(pending_removal.replacements),
+                        existing_size=tracing.get_size(injection_target_ref),
+                        result_size=tracing.get_size(injected_result)
+                    )
+            if injected_result is None:
+                logger.info(
+                    '  {}: nothing to remove or replace, skipping rebuild',
+                    pending_removal.injection_target_str
+                )
+                continue
+            setattr(target_owner, injection_target_attr_str, injected_result)
+
+
+# Drops unresolved references (pack_safe references to packs the user doesn't own
+# come through as None) and anything the target already contains, so that the
+# container is only rebuilt when there's actually something new to add.
+# Membership is checked against a set of the existing items, anything that
+# can't be hashed is kept rather than compared item by item.
+def _filter_new_sequence_items(item_list, existing_items):
+    seen = set(item for item in existing_items if is_hashable(item))
+    filtered = []
+    for item in item_list:
+        if item is None:
+            continue
+        if is_hashable(item):
+            if item in seen:
+                continue
+            seen.add(item)
+        filtered.append(item)
+    return filtered
+
+
+def _filter_new_mapping_items(item_list, existing_mapping):
+    filtered = {}
+    for key, value in item_list.items():
+        if key is None or value is None:
+            continue
+        if key in existing_mapping and existing_mapping[key] == value:
+            continue
+        filtered[key] = value
+    return filtered
+
+
+def add_list_items_by_type(item_list, injection_target_str, injection_target_ref, merge_mode=MergeMode.REPLACE):
+    with tracing.trace_span(injection_target_str, 'merge') as span_args:
+        injected_result = _add_list_items_by_type(item_list, injection_target_str, injection_target_ref, merge_mode)
+        if span_args is not None:
+            span_args.update(
+                items=tracing.get_size(item_list),
+                existing_size=tracing.get_size(injection_target_ref),
+                result_size=tracing.get_size(injected_result)
+            )
+        return injected_result
+
+
+def _add_list_items_by_type(item_list, injection_target_str, injection_target_ref, merge_mode):
     component_type = type(injection_target_ref)
+    if component_type == tuple or component_type == frozenset:
+        item_list = _filter_new_sequence_items(item_list, injection_target_ref)
+    elif component_type == frozendict or component_type == FrozenAttributeDict:
+        item_list = _filter_new_mapping_items(item_list, injection_target_ref)
+        if merge_mode == MergeMode.DEEP_MERGE:
+            # Values for keys already in the target are merged into the existing value
+            # instead of replacing it, sharing everything the merge doesn't change.
+            item_list = merge_mapping_values(injection_target_ref, item_list)
+    else:
+        logger.warn(
+            '  {}: type({}) not found in generic list injection options, this usually means a new injection needs'
+            ' to be written',
+            injection_target_str, 
+            component_type
+        )
+        return None
+    if not item_list:
+        logger.info('  {}: nothing new to add, skipping rebuild', injection_target_str)
+        return None
+
     if component_type == tuple:
         if len(injection_target_ref) > 0:
             injection_target_ref += tuple(item_list,)
@@ -111,54 +549,140 @@ def add_list_items_by_type(item_list, injection_target_str, injection_target_ref
         injection_target_ref = FrozenAttributeDict(
             {**dict(injection_target_ref), **item_list}
         )
-    else:
+    rebuild_counters.record_rebuild(injection_target_str, len(injection_target_ref))
+    if settings.DEBUG_ON:
+        logger.debug('  {}: with items added is now: {}', injection_target_str, injection_target_ref)
+    return injection_target_ref
+
+
+def flush_ordered_insertions():
+    _ordered_insertions.flushed = True
+    pending_ordered_insertions = dict(_ordered_insertions.pending)
+    _ordered_insertions.pending.clear()
+    for injection_target_str, insertions in pending_ordered_insertions.items():
+        with profiling.profile_injection(None, injection_target_str):
+            _merge_ordered_target(injection_target_str, insertions)
+
+
+def _merge_ordered_target(injection_target_str, insertions):
+    logger.info('  {}: merging {} ordered insertion(s)', injection_target_str, len(insertions))
+    injection_target_class, injection_target_attr_str = _resolve_module_target(injection_target_str)
+    injection_target_ref = getattr(injection_target_class, injection_target_attr_str)
+    if not isinstance(injection_target_ref, (tuple, frozendict, FrozenAttributeDict)):
         logger.warn(
-            '  {}: type({}) not found in generic list injection options, this usually means a new injection needs'
+            '  {}: type({}) not found in ordered injection options, this usually means a new injection needs'
             ' to be written',
-            injection_target_str, 
-            component_type
+            injection_target_str,
+            type(injection_target_ref)
         )
-        return None
+        return
+    with tracing.trace_span(injection_target_str, 'merge') as span_args:
+        injected_result, missing_anchors = merge_ordered_insertions(injection_target_ref, insertions)
+        if span_args is not None:
+            span_args.update(
+                insertions=len(insertions),
+                existing_size=len(injection_target_ref),
+                result_size=tracing.get_size(injected_result)
+            )
+    for anchor in missing_anchors:
+        logger.warn('  {}: anchor {} not found, inserted at the end instead', injection_target_str, anchor)
+    if injected_result is None:
+        logger.info('  {}: nothing new to add, skipping rebuild', injection_target_str)
+        return
+    rebuild_counters.record_rebuild(injection_target_str, len(injected_result))
     if settings.DEBUG_ON:
-        logger.debug('  {}: with items added is now: {}', injection_target_str, injection_target_ref)
-    return injection_target_ref
+        logger.debug('  {}: with items added is now: {}', injection_target_str, injected_result)
+    setattr(injection_target_class, injection_target_attr_str, injected_result)
 
 
 def add_items_to_existing_list_item(items, key_ref, key_str, value_str, injection_target):
     logger.info('  {}: adding items: {}', injection_target, items)
-    # We expect that injection target str can be formatted
-    # into module_name[0], class_name[1], and attr_name[2]
-    injection_target_list = injection_target.split(':')
-    injection_target_module_str = injection_target_list[0]
-    injection_target_class_str = injection_target_list[1]
-    injection_target_attr_str = injection_target_list[2]
-    
-    injection_target_class = getattr(
-        sys.modules[injection_target_module_str], 
-        injection_target_class_str
+    injection_target_class, injection_target_attr_str = _resolve_module_target(injection_target)
+    touched_targets.record(injection_target_class, injection_target_attr_str, injection_target)
+    _queue_keyed_operation(
+        injection_target,
+        PendingKeyedOperation.modify(items, key_ref, key_str, value_str, _keyed_operations.next_sequence())
     )
-    
-    injected_result = modify_list_item_by_type(
-        items, 
-        injection_target, 
-        getattr(
-            injection_target_class, 
-            injection_target_attr_str
-        ),
-        key_ref,
-        key_str,
-        value_str
-    )
-    
-    if injected_result is not None:
-        setattr(
-            injection_target_class, 
-            injection_target_attr_str, 
-            injected_result
-        )
+
+
+def _queue_keyed_operation(injection_target_str, keyed_operation):
+    _keyed_operations.pending.setdefault(injection_target_str, []).append(keyed_operation)
+    if _keyed_operations.flushed:
+        flush_keyed_operations()
+
+
+def flush_keyed_operations():
+    _keyed_operations.flushed = True
+    pending_keyed_operations = dict(_keyed_operations.pending)
+    _keyed_operations.pending.clear()
+    for injection_target_str, keyed_operations in pending_keyed_operations.items():
+        # Each target on its own, so one failing target doesn't drop every other target's operations.
+        with profiling.profile_injection(None, injection_target_str):
+            try:
+                _apply_keyed_target(injection_target_str, keyed_operations)
+            except:
+                logger.error('Exception occurred applying keyed operations for {}', injection_target_str)
+                logger.error(traceback.format_exc())
+
+
+# Applies every queued operation for one keyed target in dependency order,
+# threading the value through them and setting the attr once at the end.
+def _apply_keyed_target(injection_target_str, keyed_operations):
+    logger.info('  {}: applying {} add/modify operation(s)', injection_target_str, len(keyed_operations))
+    injection_target_class, injection_target_attr_str = _resolve_module_target(injection_target_str)
+    original_ref = getattr(injection_target_class, injection_target_attr_str)
+    injection_target_ref = original_ref
+    for keyed_operation in order_keyed_operations(keyed_operations):
+        if keyed_operation.kind == KEYED_ADD:
+            injected_result = add_list_items_by_type(
+                keyed_operation.item_list,
+                injection_target_str,
+                injection_target_ref,
+                merge_mode=keyed_operation.merge_mode
+            )
+        else:
+            injected_result = modify_list_item_by_type(
+                keyed_operation.item_list,
+                injection_target_str,
+                injection_target_ref,
+                keyed_operation.key_ref,
+                keyed_operation.key_str,
+                keyed_operation.value_str
+            )
+            if injected_result is None:
+                logger.warn(
+                    '  {}: key {} not found, no snippet adds it, items not added: {}',
+                    injection_target_str,
+                    keyed_operation.key_ref,
+                    keyed_operation.item_list
+                )
+        if injected_result is not None:
+            injection_target_ref = injected_result
+    if injection_target_ref is not original_ref:
+        setattr(injection_target_class, injection_target_attr_str, injection_target_ref)
 
 
 def modify_list_item_by_type(new_items, injection_target_str, injection_target_ref, key_ref, key_str, value_str):
+    with tracing.trace_span(injection_target_str, 'merge') as span_args:
+        injected_result = _modify_list_item_by_type(
+            new_items,
+            injection_target_str,
+            injection_target_ref,
+            key_ref,
+            key_str,
+            value_str
+        )
+        if span_args is not None:
+            span_args.update(
+                items=tracing.get_size(new_items),
+                existing_size=tracing.get_size(injection_target_ref),
+                key=key_ref,
+                result_size=tracing.get_size(injected_result)
+            )
+        return injected_result
+
+
+def _modify_list_item_by_type(new_items, injection_target_str, injection_target_ref, key_ref, key_str, value_str):
     component_type = type(injection_target_ref)
     if component_type == tuple:
         # Do type deduction voodoo to determine if it's a tuple of ImmutableSlots
@@ -170,9 +694,13 @@ def modify_list_item_by_type(new_items, injection_target_str, injection_target_r
                     existing_as_list = list(injection_target_ref)
                     values = dict()
                     values[value_str] = getattr(existing_as_list[index], value_str) + tuple(new_items,)
-                    existing_as_list[index] = existing_as_list[index].clone_with_overrides(**values)
+                    with tracing.trace_span(type(existing_item).__name__, 'clone') as span_args:
+                        existing_as_list[index] = existing_as_list[index].clone_with_overrides(**values)
+                        if span_args is not None:
+                            span_args['overrides'] = tuple(values)
                     # Change back into tuple when we're done
                     injection_target_ref = tuple(existing_as_list,)
+                    rebuild_counters.record_rebuild(injection_target_str, len(injection_target_ref))
                     if settings.DEBUG_ON:
                         logger.debug('  {}: with items added is now: {}', injection_target_str, injection_target_ref)
                     return injection_target_ref
@@ -184,6 +712,7 @@ def modify_list_item_by_type(new_items, injection_target_str, injection_target_r
             modified_dict = existing_dict
             modified_dict[key_ref] = modified_value
             injection_target_ref = frozendict(modified_dict)
+            rebuild_counters.record_rebuild(injection_target_str, len(injection_target_ref))
             if settings.DEBUG_ON:
                 logger.debug('  {}: with items added is now: {}', injection_target_str, injection_target_ref)
             return injection_target_ref
@@ -0,0 +1,129 @@
+import functools
+import itertools
+import sys
+import sims4.log
+
+from temporal_module_injector import settings
+
+logger = sims4.log.Logger('TemporalModuleInjector')
+
+# Interaction attrs whose items are advertisements autonomy scores.
+AD_ATTRS = frozenset(('_static_commodities', '_false_advertisements', '_hidden_false_advertisements'))
+
+
+class AffordanceAdCost:
+    __slots__ = ('affordance', 'original_count', 'added_count', 'scored_count', '_counted_attrs')
+
+    def __init__(self, affordance):
+        self.affordance = affordance
+        self.original_count = 0
+        self.added_count = 0
+        self.scored_count = 0
+        self._counted_attrs = set()
+
+    def record_added_ads(self, attr_name, original_ads, added_ads):
+        # Each ad attr's original ads are counted the first time TMI adds to it.
+        if attr_name not in self._counted_attrs:
+            self._counted_attrs.add(attr_name)
+            self.original_count += len(original_ads)
+        self.added_count += len(added_ads)
+
+    @property
+    def is_flagged(self):
+        return self.added_count > settings.AUTONOMY_AD_GROWTH_THRESHOLD
+
+
+# Advertisements TMI added, per affordance and per static commodity (or stat),
+# which is autonomy work TMI creates for the rest of the session.
+class AutonomyCostReport:
+    def __init__(self):
+        self.by_affordance = {}
+        # Commodity (or stat) -> affordances TMI added an ad for it to.
+        self.by_commodity = {}
+
+    def record_added_ads(self, affordance, attr_name, original_ads, added_ads):
+        if attr_name not in AD_ATTRS or not added_ads:
+            return
+        ad_cost = self.by_affordance.get(affordance)
+        if ad_cost is None:
+            ad_cost = AffordanceAdCost(affordance)
+            self.by_affordance[affordance] = ad_cost
+        ad_cost.record_added_ads(attr_name, original_ads, added_ads)
+        for ad in added_ads:
+            commodity = getattr(ad, 'static_commodity', None) or getattr(ad, 'stat', None) or ad
+            self.by_commodity.setdefault(commodity, set()).add(affordance)
+
+    def record_scored(self, affordance):
+        ad_cost = self.by_affordance.get(affordance)
+        if ad_cost is not None:
+            ad_cost.scored_count += 1
+
+    def get_flagged(self):
+        return sorted(
+            (ad_cost for ad_cost in self.by_affordance.values() if ad_cost.is_flagged),
+            key=lambda ad_cost: ad_cost.added_count,
+            reverse=True
+        )
+
+    def get_report_lines(self, top=10):
+        lines = ['{} ad(s) added to {} affordance(s), {} affordance(s) over the growth threshold of {}'.format(
+            sum(ad_cost.added_count for ad_cost in self.by_affordance.values()),
+            len(self.by_affordance),
+            len(self.get_flagged()),
+            settings.AUTONOMY_AD_GROWTH_THRESHOLD
+        )]
+        for ad_cost in self.get_flagged()[:top]:
+            lines.append('  {}: {} -> {} ad(s){}'.format(
+                ad_cost.affordance.__name__,
+                ad_cost.original_count,
+                ad_cost.original_count + ad_cost.added_count,
+                ', scored {} time(s)'.format(ad_cost.scored_count) if settings.AUTONOMY_SAMPLING_ON else ''
+            ))
+        by_commodity = sorted(
+            self.by_commodity.items(),
+            key=lambda commodity_affordances: len(commodity_affordances[1]),
+            reverse=True
+        )
+        for commodity, affordances in by_commodity[:top]:
+            lines.append('  {}: added to {} affordance(s)'.format(
+                getattr(commodity, '__name__', commodity),
+                len(affordances)
+            ))
+        return lines
+
+
+autonomy_cost_report = AutonomyCostReport()
+
+
+def log_report():
+    for line in autonomy_cost_report.get_report_lines():
+        logger.info('Autonomy cost: {}', line)
+
+
+def _sample_scoring(original):
+    @functools.wraps(original)
+    def wrapped(*args, **kwargs):
+        # Signatures differ between scoring functions, so count the first argument
+        # that is (or, like an AOP or interaction, has) an affordance TMI added ads to.
+        by_affordance = autonomy_cost_report.by_affordance
+        for arg in itertools.chain(args, kwargs.values()):
+            affordance = getattr(arg, 'affordance', arg)
+            if isinstance(affordance, type) and affordance in by_affordance:
+                autonomy_cost_report.record_scored(affordance)
+                break
+        return original(*args, **kwargs)
+    return wrapped
+
+
+def install_scoring_sampler():
+    module_str, class_str, attr_str = settings.AUTONOMY_SAMPLING_HOOK.split(':')
+    target_class = getattr(sys.modules.get(module_str), class_str, None)
+    original = getattr(target_class, attr_str, None) if target_class is not None else None
+    if original is None:
+        logger.warn('Autonomy sampling hook {} not found, not sampling', settings.AUTONOMY_SAMPLING_HOOK)
+        return
+    if isinstance(vars(target_class).get(attr_str), (classmethod, staticmethod)):
+        logger.warn('Autonomy sampling hook {} must be a plain method, not sampling', settings.AUTONOMY_SAMPLING_HOOK)
+        return
+    setattr(target_class, attr_str, _sample_scoring(original))
+    logger.info('Sampling autonomy scoring through {}', settings.AUTONOMY_SAMPLING_HOOK)
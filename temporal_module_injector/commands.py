@@ -0,0 +1,133 @@
+import itertools
+import sims4.commands
+
+from temporal_module_injector import add_to_tuning
+from temporal_module_injector import profiling
+from temporal_module_injector import shared_structure_scanner
+from temporal_module_injector import target_inspection
+from temporal_module_injector import target_snapshot
+from temporal_module_injector.autonomy_cost_report import autonomy_cost_report
+from temporal_module_injector.touched_targets import touched_targets
+
+
+@sims4.commands.Command('tmi.scan_shared_structures', command_type=sims4.commands.CommandType.Live)
+def scan_shared_structures(limit:int=20, _connection=None):
+    output = sims4.commands.CheatOutput(_connection)
+    shared = shared_structure_scanner.scan_shared_structures()
+    output('{} shared ImmutableSlots found (~{} bytes), showing top {}:'.format(
+        len(shared),
+        sum(structure.estimated_size for structure in shared),
+        min(limit, len(shared))
+    ))
+    for structure in shared[:limit]:
+        output('  {} owners, ~{} bytes, {}: {}'.format(
+            len(structure.owners),
+            structure.estimated_size,
+            type(structure.obj).__name__,
+            ', '.join(structure.owners[:5]) + (', ...' if len(structure.owners) > 5 else '')
+        ))
+
+
+@sims4.commands.Command('tmi.rebuild_counters', command_type=sims4.commands.CommandType.Live)
+def show_rebuild_counters(top:int=10, _connection=None):
+    output = sims4.commands.CheatOutput(_connection)
+    counters = add_to_tuning.rebuild_counters
+    output(counters.get_summary())
+    by_target = sorted(counters.rebuilds_by_target.items(), key=lambda target_count: target_count[1], reverse=True)
+    for target_key, rebuild_count in by_target[:top]:
+        output('  {}: {} rebuild(s)'.format(target_key, rebuild_count))
+
+
+@sims4.commands.Command('tmi.dump_profile', command_type=sims4.commands.CommandType.Live)
+def dump_injection_profile(_connection=None):
+    output = sims4.commands.CheatOutput(_connection)
+    profiling.dump_profile()
+    output('Dumped the injection profile, if one was captured (see settings.PROFILE_ON)')
+
+
+@sims4.commands.Command('tmi.autonomy_cost', command_type=sims4.commands.CommandType.Live)
+def show_autonomy_cost(top:int=10, _connection=None):
+    output = sims4.commands.CheatOutput(_connection)
+    for line in autonomy_cost_report.get_report_lines(top=top):
+        output(line)
+
+
+@sims4.commands.Command('tmi.snapshot', command_type=sims4.commands.CommandType.Live)
+def take_target_snapshot(_connection=None):
+    output = sims4.commands.CheatOutput(_connection)
+    snapshot = target_snapshot.take_snapshot()
+    output('Wrote {} target hashes to {}'.format(len(snapshot), target_snapshot.write_snapshot(snapshot)))
+    baseline = target_snapshot.read_snapshot()
+    if baseline is None:
+        output('No baseline saved yet, use tmi.snapshot_save_baseline')
+        return
+    for line in target_snapshot.get_comparison_lines(baseline, snapshot):
+        output(line)
+
+
+@sims4.commands.Command('tmi.snapshot_save_baseline', command_type=sims4.commands.CommandType.Live)
+def save_target_snapshot_baseline(_connection=None):
+    output = sims4.commands.CheatOutput(_connection)
+    snapshot = target_snapshot.take_snapshot()
+    snapshot_path = target_snapshot.write_snapshot(snapshot, file_name=target_snapshot.BASELINE_FILE_NAME)
+    output('Saved {} target hashes as the baseline in {}'.format(len(snapshot), snapshot_path))
+
+
+def _get_touched_target(output, target):
+    touched_target = touched_targets.get_by_label(target)
+    if touched_target is None:
+        output('No touched target {}, use tmi.targets to list them'.format(target))
+        return None, None
+    value, is_lazy = target_inspection.get_target_value(touched_target)
+    if is_lazy:
+        output('{} is lazy and not materialized yet, showing its original value'.format(target))
+    return touched_target, value
+
+
+@sims4.commands.Command('tmi.targets', command_type=sims4.commands.CommandType.Live)
+def list_touched_targets(offset:int=0, limit:int=20, _connection=None):
+    output = sims4.commands.CheatOutput(_connection)
+    output('{} touched target(s), showing {} from {}:'.format(len(touched_targets), limit, offset))
+    for touched_target in itertools.islice(touched_targets, offset, offset + limit):
+        value, is_lazy = target_inspection.get_target_value(touched_target)
+        output('  {}: {} {} item(s){}, from {}'.format(
+            touched_target.label,
+            type(value).__name__,
+            target_inspection.get_target_size(value),
+            ' (lazy)' if is_lazy else '',
+            ', '.join(touched_target.snippet_names)
+        ))
+
+
+@sims4.commands.Command('tmi.target', command_type=sims4.commands.CommandType.Live)
+def show_target_page(target:str, offset:int=0, limit:int=20, _connection=None):
+    output = sims4.commands.CheatOutput(_connection)
+    touched_target, value = _get_touched_target(output, target)
+    if touched_target is None:
+        return
+    output('{}: {} {} item(s), showing {} from {}:'.format(
+        target,
+        type(value).__name__,
+        target_inspection.get_target_size(value),
+        limit,
+        offset
+    ))
+    for key, item in target_inspection.iter_target_page(value, offset, limit):
+        output('  [{}] {}'.format(target_inspection.format_value(key), target_inspection.format_value(item)))
+
+
+@sims4.commands.Command('tmi.target_key', command_type=sims4.commands.CommandType.Live)
+def show_target_key(target:str, key:str, _connection=None):
+    output = sims4.commands.CheatOutput(_connection)
+    touched_target, value = _get_touched_target(output, target)
+    if touched_target is None:
+        return
+    entry = target_inspection.find_target_entry(value, key)
+    if entry is None:
+        output('{}: no entry for {}'.format(target, key))
+        return
+    output('{}: [{}] {}'.format(
+        target,
+        target_inspection.format_value(entry[0]),
+        target_inspection.format_value(entry[1])
+    ))
@@ -0,0 +1,116 @@
+import hashlib
+import sims4.log
+from sims4.collections import _ImmutableSlotsBase
+
+logger = sims4.log.Logger('TemporalModuleInjector')
+
+# Variant options, besides the target and items, that change what an entry does.
+_OPTION_ATTRS = ('key_ref', 'key_str', 'value_str', 'merge_mode', 'insert_position', 'injection_timing')
+# Guards against self referencing tuned values.
+_MAX_CANONICAL_DEPTH = 32
+
+
+# Canonical, hashable form of a tuned value that's stable between loads:
+# tuning references become their guid64, set contents are sorted, and plain
+# objects are reduced to their type and attributes (so memory addresses in
+# their repr never leak into a hash). Sequences always keep their order.
+# Mapping entries are sorted by key, unless ordered is set, in which case they
+# keep their iteration order too (ex: for BUCKET_SCORING_RULES, where ordered
+# insertions decide the order).
+def get_canonical_value(value, ordered=False, _depth=0):
+    if _depth > _MAX_CANONICAL_DEPTH:
+        return 'too_deep',
+    depth = _depth + 1
+    guid64 = getattr(value, 'guid64', None)
+    if isinstance(value, type) and guid64 is not None:
+        return 'ref', guid64
+    if isinstance(value, _ImmutableSlotsBase):
+        return 'slots', tuple(
+            (slot_name, get_canonical_value(getattr(value, slot_name, None), ordered, depth))
+            for slot_name in getattr(type(value), '__slots__', ())
+        )
+    if isinstance(value, (tuple, list)):
+        return 'seq', tuple(get_canonical_value(item, ordered, depth) for item in value)
+    if isinstance(value, (frozenset, set)):
+        return 'set', tuple(sorted((get_canonical_value(item, ordered, depth) for item in value), key=repr))
+    if hasattr(value, 'items'):
+        entries = tuple(
+            (get_canonical_value(key, ordered, depth), get_canonical_value(item, ordered, depth))
+            for key, item in value.items()
+        )
+        if ordered:
+            return 'map', entries
+        return 'map', tuple(sorted(entries, key=lambda entry: repr(entry[0])))
+    if isinstance(value, type):
+        return 'type', value.__module__, value.__qualname__
+    if isinstance(value, (str, int, float, bool, bytes)) or value is None:
+        return 'value', type(value).__name__, repr(value)
+    if hasattr(value, '__dict__'):
+        return 'object', type(value).__qualname__, tuple(
+            (attr_name, get_canonical_value(attr_value, ordered, depth))
+            for attr_name, attr_value in sorted(vars(value).items())
+        )
+    return 'value', type(value).__name__, repr(value)
+
+
+# Hash of everything that decides what an entry does: the section, the variant,
+# its target (and resolved target tunings), its options and its items. Items are
+# sorted, so the same items in a different order still count as the same entry.
+def get_entry_fingerprint(section, new_items):
+    get_target_tunings = getattr(new_items, 'get_target_tunings', None)
+    target_guids = () if get_target_tunings is None else tuple(sorted(
+        getattr(tuning, 'guid64', 0) for tuning in get_target_tunings()
+    ))
+    item_list = new_items.item_list
+    if hasattr(item_list, 'items'):
+        items = sorted((repr((get_canonical_value(key), get_canonical_value(item))) for key, item in item_list.items()))
+    else:
+        items = sorted(repr(get_canonical_value(item)) for item in item_list)
+    options = tuple((attr, get_canonical_value(getattr(new_items, attr, None))) for attr in _OPTION_ATTRS)
+    canonical_entry = (
+        section,
+        type(new_items).__name__,
+        new_items.get_injection_target_label(),
+        target_guids,
+        options,
+        tuple(items)
+    )
+    return hashlib.blake2b(repr(canonical_entry).encode('utf-8'), digest_size=16).digest()
+
+
+# Remembers the fingerprint of every entry applied so far, so the same entry
+# arriving again under another snippet (ex: the same compatibility snippet
+# bundled by two mods) is skipped with one dict lookup. Entries only count as
+# applied once their injection has gone through, so a failed entry doesn't
+# cause a later copy of it to be skipped.
+class DuplicateEntryFilter:
+    def __init__(self):
+        self._applied = {}
+        self._skipped = {}
+
+    # The entry's fingerprint, or None (with the skip recorded) if it was already applied.
+    def get_unapplied_fingerprint(self, snippet_name, section, new_items):
+        fingerprint = get_entry_fingerprint(section, new_items)
+        first_snippet_name = self._applied.get(fingerprint)
+        if first_snippet_name is None:
+            return fingerprint
+        skip_key = (snippet_name, first_snippet_name)
+        self._skipped[skip_key] = self._skipped.get(skip_key, 0) + 1
+        return None
+
+    def mark_applied(self, fingerprint, snippet_name):
+        self._applied.setdefault(fingerprint, snippet_name)
+
+    def log_summary(self):
+        if not self._skipped:
+            return
+        logger.info(
+            'Skipped {} duplicate entries from {} snippet(s)',
+            sum(self._skipped.values()),
+            len(set(snippet_name for snippet_name, _ in self._skipped))
+        )
+        for (snippet_name, first_snippet_name), count in self._skipped.items():
+            logger.info('  {}: {} entries already applied by {}', snippet_name, count, first_snippet_name)
+
+
+duplicate_entry_filter = DuplicateEntryFilter()
@@ -0,0 +1,119 @@
+import collections
+import functools
+import time
+import traceback
+import alarms
+import clock
+import sims4.log
+from zone import Zone
+
+from temporal_module_injector import add_to_tuning
+from temporal_module_injector import profiling
+from temporal_module_injector import settings
+from temporal_module_injector import target_snapshot
+from temporal_module_injector import tracing
+
+logger = sims4.log.Logger('TemporalModuleInjector')
+
+
+class _DeferredInjection:
+    __slots__ = ('label', 'apply')
+
+    def __init__(self, label, apply):
+        self.label = label
+        self.apply = apply
+
+
+# Cooperative scheduler for DEFERRED injections. Nothing runs until the first
+# zone has finished loading, then each slice applies queued injections until
+# its time budget is spent and hands the rest to a real time alarm.
+class DeferredInjectionScheduler:
+    def __init__(self):
+        self._queue = collections.deque()
+        self._alarm_handle = None
+        self._applied_count = 0
+
+    @property
+    def pending_count(self):
+        return len(self._queue)
+
+    def add(self, label, apply):
+        self._queue.append(_DeferredInjection(label, apply))
+
+    def start(self):
+        if not self._queue or self._alarm_handle is not None:
+            return
+        logger.info('Starting {} deferred injection(s)', len(self._queue))
+        self._run_slice()
+        if self._queue:
+            self._alarm_handle = alarms.add_alarm_real_time(
+                self,
+                clock.interval_in_real_seconds(settings.DEFERRED_SLICE_INTERVAL_MS / 1000),
+                self._on_slice_alarm,
+                repeating=True
+            )
+
+    # The alarm goes away with the zone, the rest of the queue carries on in the next zone.
+    def stop(self):
+        if self._alarm_handle is not None:
+            alarms.cancel_alarm(self._alarm_handle)
+            self._alarm_handle = None
+
+    def _on_slice_alarm(self, _alarm_handle):
+        self._run_slice()
+        if not self._queue and self._alarm_handle is not None:
+            alarms.cancel_alarm(self._alarm_handle)
+            self._alarm_handle = None
+
+    def _run_slice(self):
+        deadline = time.perf_counter() + settings.DEFERRED_SLICE_BUDGET_MS / 1000
+        while self._queue:
+            deferred_injection = self._queue.popleft()
+            with profiling.profile_injection(None, deferred_injection.label), \
+                    tracing.trace_span(deferred_injection.label, 'deferred'):
+                try:
+                    deferred_injection.apply()
+                except:
+                    logger.error('Exception occurred applying deferred injection {}', deferred_injection.label)
+                    logger.error(traceback.format_exc())
+            self._applied_count += 1
+            if time.perf_counter() >= deadline:
+                break
+        if not self._queue:
+            logger.info('Finished {} deferred injection(s)', self._applied_count)
+            # Removals run again, so they also apply to items the deferred injections added.
+            try:
+                add_to_tuning.flush_removals()
+            except:
+                logger.error('Exception occurred applying TemporalModuleInjector removals after deferred injections')
+                logger.error(traceback.format_exc())
+            if settings.TARGET_SNAPSHOT_ON:
+                target_snapshot.write_and_compare()
+            if settings.PROFILE_ON:
+                profiling.dump_profile()
+            if settings.TRACE_ON:
+                tracing.dump_trace()
+
+
+deferred_injection_scheduler = DeferredInjectionScheduler()
+
+
+def _start_after_loading_screen(original):
+    @functools.wraps(original)
+    def wrapped(self, *args, **kwargs):
+        result = original(self, *args, **kwargs)
+        deferred_injection_scheduler.start()
+        return result
+    return wrapped
+
+
+def _stop_on_teardown(original):
+    @functools.wraps(original)
+    def wrapped(self, *args, **kwargs):
+        deferred_injection_scheduler.stop()
+        return original(self, *args, **kwargs)
+    return wrapped
+
+
+Zone.on_loading_screen_animation_finished = _start_after_loading_screen(Zone.on_loading_screen_animation_finished)
+Zone.on_teardown = _stop_on_teardown(Zone.on_teardown)
@@ -1,9 +1,10 @@
 import services
+import sims4.log
 import sims4.resources
 from sims4.resources import Types
 from sims4.tuning.tunable import HasTunableSingletonFactory, AutoFactoryInit, TunableMapping, TunableList, \
     TunableTuple, TunableEnumEntry, OptionalTunable, TunablePercent, Tunable, TunableReference, TunableSet, \
-    TunableRange, TunableVariant, TunableSimMinute
+    TunableRange, TunableVariant, TunableSimMinute, TunableBase
 from sims4.tuning.tunable_base import GroupNames
 from sims.pregnancy.pregnancy_enums import PregnancyOrigin
 from relationships.relationship_tracker_tuning import DefaultGenealogyLink
@@ -27,8 +28,15 @@ from traits.traits import TraitBuffReplacementPriority
 from buffs.tunable import TunableBuffReference
 from whims.whims_tracker import WhimsTracker
 from interactions.utils.tunable import TunableStatisticAdvertisements
+from tag import Tag
+from traits.trait_type import TraitType
 import enum
 
+from temporal_module_injector import tuning_index
+from temporal_module_injector.module_target_trie import module_target_trie
+
+logger = sims4.log.Logger('TemporalModuleInjector')
+
 
 # Injection target can be a module path (e.g. class name/attr/etc.)
 # And can be a tuning reference (ex: to a buff) with an attr target
@@ -39,6 +47,77 @@ class InjectionTargetType(enum.Int):
     TUNING_REF_ATTR = 2
 
 
+# How mapping items are merged into a target that already has the same key.
+# REPLACE swaps the existing value out for the new one.
+# DEEP_MERGE merges the new value into the existing one (ex: a second mod's
+# trait_entries are added to the existing ones), keeping existing scalar values,
+# see structural_merge.deep_merge.
+class MergeMode(enum.Int):
+    REPLACE = 0
+    DEEP_MERGE = 1
+
+
+def TunableMergeMode():
+    return TunableEnumEntry(
+        description='How to merge items whose key already exists in the target. REPLACE swaps out the existing '
+                    'value, DEEP_MERGE merges the new value into it, keeping everything already there.',
+        tunable_type=MergeMode,
+        default=MergeMode.REPLACE
+    )
+
+
+# Where items go in targets whose order matters (ex: ENSEMBLE_PRIORITIES).
+# Insertions into ordered targets are queued and applied together,
+# in one pass per target, once every snippet has loaded.
+class InsertPosition(enum.Int):
+    END = 0
+    START = 1
+    BEFORE = 2
+    AFTER = 3
+
+
+# Left unset, items are appended to the target as usual, without going
+# through the ordered insertion queue.
+def TunableInsertPosition(anchor):
+    return OptionalTunable(
+        description='Where the items are inserted in the target. Leave unset to append them to the end.',
+        tunable=TunableTuple(
+            position=TunableEnumEntry(
+                description='END and START insert at either end of the target, BEFORE and AFTER insert next to '
+                            'the anchor (or at the end, if the anchor is not in the target).',
+                tunable_type=InsertPosition,
+                default=InsertPosition.END
+            ),
+            anchor=anchor,
+            priority=Tunable(
+                description='Insertions at the same position are ordered by priority, highest first. Insertions '
+                            'with the same priority keep their load order.',
+                tunable_type=int,
+                default=0
+            )
+        )
+    )
+
+
+# When items are added. CRITICAL injections happen as the snippet loads.
+# DEFERRED injections wait until the first zone has finished loading and then
+# run a few at a time, in bounded time slices, so they don't lengthen the
+# loading screen. Only for targets that aren't needed before gameplay starts.
+class InjectionTiming(enum.Int):
+    CRITICAL = 0
+    DEFERRED = 1
+
+
+def TunableInjectionTiming(default=InjectionTiming.CRITICAL):
+    return TunableEnumEntry(
+        description='CRITICAL adds the items while tuning loads. DEFERRED adds them in small time slices after the '
+                    'first zone has loaded, for targets not needed before gameplay starts. Only used when adding '
+                    'items, removals and replacements tuned as DEFERRED are ignored.',
+        tunable_type=InjectionTiming,
+        default=default
+    )
+
+
 class FactoryVariantBase(HasTunableSingletonFactory, AutoFactoryInit):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -47,6 +126,15 @@ class FactoryVariantBase(HasTunableSingletonFactory, AutoFactoryInit):
     def get_injection_target_type(self):
         return self._injection_target_type
     
+    # Short human readable name for what this variant injects into,
+    # used for logging, profiling scope, etc.
+    def get_injection_target_label(self):
+        return ''
+
+    # Variants whose target comes from the xml check it here before anything is injected.
+    def is_allowed_injection_target(self):
+        return True
+
     FACTORY_TUNABLES = {
         'is_xml_usable_variant': Tunable(
             description='Design safeguard for determining whether a variant should be something you can use '
@@ -57,7 +145,8 @@ class FactoryVariantBase(HasTunableSingletonFactory, AutoFactoryInit):
                         'what I was thinking. [Addendum: Its true, idk what I was thinking.]',
             tunable_type=bool, 
             default=False
-        )
+        ),
+        'injection_timing': TunableInjectionTiming()
     }
 
 
@@ -74,6 +163,9 @@ class ModuleVariantBase(FactoryVariantBase):
         super().__init__(*args, **kwargs)
         self._injection_target_type = InjectionTargetType.MODULE_PATH
     
+    def get_injection_target_label(self):
+        return self.injection_target_str
+
     FACTORY_TUNABLES = {
         'injection_target_str': Tunable(
             description='The target path of the injection, including module path, class name, and class attribute. '
@@ -98,6 +190,22 @@ class TuningRefVariantBase(FactoryVariantBase):
         super().__init__(*args, **kwargs)
         self._injection_target_type = InjectionTargetType.TUNING_REF_ATTR
     
+    def get_injection_target_label(self):
+        return self.injection_target_attr_str
+
+    # Derived variants with selectors (ex: all affordances with a tag)
+    # should extend this with their selector results.
+    def get_target_tunings(self):
+        return self.target_tuning_list
+
+    @staticmethod
+    def _merge_target_tunings(target_tuning_list, selected):
+        if not selected:
+            return target_tuning_list
+        merged = dict.fromkeys(target_tuning_list)
+        merged.update(dict.fromkeys(selected))
+        return tuple(merged)
+
     FACTORY_TUNABLES = {
         'injection_target_attr_str': Tunable(
             description='The attr to be modified within the tuning ref (ex: _loot_on_instance in a Buff).',
@@ -107,6 +215,24 @@ class TuningRefVariantBase(FactoryVariantBase):
     }
 
 
+# Tuning ref variants that target big tunable trees (ex: Trait buff_replacements)
+# use the game's own tunable definition for their item_list where it can be found,
+# rather than building and holding a hand-copied duplicate of the tree that
+# drifts whenever a patch changes the original. The hand-copied tree is only
+# built, as a fallback, when the game's definition can't be found.
+def get_instance_target_tunable(target_class, attr_str, fallback_tunable_factory):
+    tunable = vars(target_class).get('INSTANCE_TUNABLES', {}).get(attr_str)
+    if isinstance(tunable, TunableBase):
+        logger.info('  {}.{}: using the game tunable definition for item_list', target_class.__name__, attr_str)
+        return tunable
+    logger.info(
+        '  {}.{}: game tunable definition not found, using fallback for item_list',
+        target_class.__name__,
+        attr_str
+    )
+    return fallback_tunable_factory()
+
+
 # sims.pregnancy.pregnancy_tracker.PregnancyTracker
 
 class PregnancyOriginModifiers(ModuleVariantBase):
@@ -174,6 +300,7 @@ class PregnancyOriginModifiers(ModuleVariantBase):
                 )
             )
         ),
+        'merge_mode': TunableMergeMode(),
         'locked_args': {
             'injection_target_str': 'sims.pregnancy.pregnancy_tracker:PregnancyTracker:PREGNANCY_ORIGIN_MODIFIERS',
             'is_xml_usable_variant': True
@@ -282,6 +409,7 @@ class BabyDefaultBassinetsExistingTraitAsKey(ModuleVariantBase):
             'injection_target_str': 'sims.baby.baby_tuning:BabyTuning:BABY_DEFAULT_BASSINETS', 
             'key_str': 'traits', 
             'value_str': 'bassinets',
+            'injection_timing': InjectionTiming.CRITICAL,
             'is_xml_usable_variant': True
         }
     }
@@ -313,6 +441,9 @@ class BuckTypeToTrackerMap(ModuleVariantBase):
 # clubs.club_tuning.ClubTunables
 
 class ClubTraits(ModuleVariantBase):
+    # Lets tools/compile_injection_plan.py compile this variant's entries into injection plans.
+    PLAN_ITEM_TYPE = Types.TRAIT
+
     FACTORY_TUNABLES = {
         'item_list': TunableSet(
             description='A set of traits available for use with club rules and admission criteria. '
@@ -337,6 +468,7 @@ class ClubSeedsSecondary(ModuleVariantBase):
                 pack_safe=True
             )
         ),
+        'injection_timing': TunableInjectionTiming(default=InjectionTiming.DEFERRED),
         'locked_args': {
             'injection_target_str': 'clubs.club_tuning:ClubTunables:CLUB_SEEDS_SECONDARY',
             'is_xml_usable_variant': True
@@ -390,6 +522,13 @@ class BucketScoringRules(ModuleVariantBase):
                 )
             )
         ),
+        'insert_position': TunableInsertPosition(
+            anchor=TunableEnumEntry(
+                description='The scoring bucket to insert before or after.',
+                tunable_type=DramaNodeScoringBucket,
+                default=DramaNodeScoringBucket.DEFAULT
+            )
+        ),
         'locked_args': {
             'injection_target_str': 'drama_scheduler.drama_scheduler:DramaScheduleService:BUCKET_SCORING_RULES',
             'is_xml_usable_variant': True
@@ -400,6 +539,9 @@ class BucketScoringRules(ModuleVariantBase):
 # ensemble.ensemble.Ensemble
 
 class EnsemblePriorities(ModuleVariantBase):
+    # Lets tools/compile_injection_plan.py compile this variant's entries into injection plans.
+    PLAN_ITEM_TYPE = Types.ENSEMBLE
+
     FACTORY_TUNABLES = {
         'item_list': TunableList(
             description='A list of ensembles by priority.  Those with higher guids will be considered more important '
@@ -410,6 +552,14 @@ class EnsemblePriorities(ModuleVariantBase):
                 pack_safe=True
             )
         ),
+        'insert_position': TunableInsertPosition(
+            anchor=TunableReference(
+                description='The ensemble to insert before or after.',
+                manager=services.get_instance_manager(sims4.resources.Types.ENSEMBLE),
+                allow_none=True,
+                pack_safe=True
+            )
+        ),
         'locked_args': {
             'injection_target_str': 'ensemble.ensemble:Ensemble:ENSEMBLE_PRIORITIES',
             'is_xml_usable_variant': True
@@ -420,6 +570,9 @@ class EnsemblePriorities(ModuleVariantBase):
 # statistics.lifestyle_service.LifestyleService
 
 class TraitReferenceList(ModuleVariantBase):
+    # Lets tools/compile_injection_plan.py compile this variant's entries into injection plans.
+    PLAN_ITEM_TYPE = Types.TRAIT
+
     FACTORY_TUNABLES = {
         'item_list': TunableList(
             description='A list of trait references.', 
@@ -502,6 +655,7 @@ class AwayActionsExistingKey(ModuleVariantBase):
             'injection_target_str': 'sims.sim_info:SimInfo:AWAY_ACTIONS',
             'key_str': '',
             'value_str': '',
+            'injection_timing': InjectionTiming.CRITICAL,
             'is_xml_usable_variant': True
         }
     }
@@ -628,6 +782,7 @@ class TeleportDataMapping(ModuleVariantBase):
                 )
             )
         ),
+        'merge_mode': TunableMergeMode(),
         'locked_args': {
             'injection_target_str': 'teleport.teleport_tuning:TeleportTuning:TELEPORT_DATA_MAPPING',
             'is_xml_usable_variant': True
@@ -703,6 +858,7 @@ class SatisfactionStoreItems(ModuleVariantBase):
                 cost=Tunable(tunable_type=int, default=100)
             )
         ),
+        'injection_timing': TunableInjectionTiming(default=InjectionTiming.DEFERRED),
         'locked_args': {
             'injection_target_str': 'whims.whims_tracker:WhimsTracker:SATISFACTION_STORE_ITEMS',
             'is_xml_usable_variant': True
@@ -710,18 +866,80 @@ class SatisfactionStoreItems(ModuleVariantBase):
     }
 
 
+# Generic module target, for targets that are a plain collection of tuning references.
+# Rather than a class with a locked injection_target_str per target, the path comes
+# from the xml, and is only accepted if it's in module_target_allowlist.json.
+# The reference options are built from the instance types the allowlist uses.
+
+def _allowlisted_item_tunable():
+    return TunableVariant(
+        description='A reference to a tuning of the instance type the target holds.',
+        **{
+            instance_type.name.lower(): TunableReference(
+                manager=services.get_instance_manager(instance_type),
+                pack_safe=True
+            )
+            for instance_type in module_target_trie.get_allowlisted_instance_types()
+        }
+    )
+
+
+class AllowlistedModuleTarget(ModuleVariantBase):
+    def is_allowed_injection_target(self):
+        resolver = module_target_trie.get_allowlisted(self.injection_target_str)
+        if resolver is None:
+            logger.warn('  {}: is not an allowlisted module target, ignoring it', self.injection_target_str)
+            return False
+        manager = services.get_instance_manager(resolver.instance_type)
+        for item in self.item_list:
+            if manager.get(getattr(item, 'guid64', None)) is not item:
+                logger.warn(
+                    '  {}: {} is not a {} tuning, ignoring the entry',
+                    self.injection_target_str,
+                    item,
+                    resolver.instance_type
+                )
+                return False
+        return True
+
+    FACTORY_TUNABLES = {
+        'item_list': TunableList(
+            description='A list of tuning references to add to the allowlisted target.',
+            tunable=_allowlisted_item_tunable()
+        ),
+        'locked_args': {
+            'is_xml_usable_variant': True
+        }
+    }
+
+
 # buffs.buff.Buff
 
 class BuffTarget(TuningRefVariantBase):
+    TARGET_INSTANCE_TYPE = Types.BUFF
+
+    def get_target_tunings(self):
+        return self._merge_target_tunings(
+            self.target_tuning_list,
+            tuning_index.BUFFS_BY_MOOD.select(self.target_moods)
+        )
+
     FACTORY_TUNABLES = {
         'target_tuning_list': TunableList(
             description='List of buff tuning references.', 
             tunable=TunableReference(manager=services.get_instance_manager(Types.BUFF))
+        ),
+        'target_moods': TunableList(
+            description='Also target every buff whose mood is one of these moods.',
+            tunable=TunableReference(manager=services.get_instance_manager(Types.MOOD), pack_safe=True)
         )
     }
 
 
 class BuffLootListTarget(BuffTarget):
+    # Lets tools/compile_injection_plan.py compile this variant's entries into injection plans.
+    PLAN_ITEM_TYPE = Types.ACTION
+
     FACTORY_TUNABLES = {
         'item_list': TunableList(
             description='List of loot tuning references.', 
@@ -760,15 +978,30 @@ class BuffLootOnRemove(BuffLootListTarget):
 # trait.traits.Trait
 
 class TraitTarget(TuningRefVariantBase):
+    TARGET_INSTANCE_TYPE = Types.TRAIT
+
+    def get_target_tunings(self):
+        return self._merge_target_tunings(
+            self.target_tuning_list,
+            tuning_index.TRAITS_BY_TYPE.select(self.target_trait_types)
+        )
+
     FACTORY_TUNABLES = {
         'target_tuning_list': TunableList(
             description='List of trait tuning references.', 
             tunable=Trait.TunableReference(pack_safe=True)
+        ),
+        'target_trait_types': TunableList(
+            description='Also target every trait whose trait type is one of these types.',
+            tunable=TunableEnumEntry(tunable_type=TraitType, default=TraitType.PERSONALITY)
         )
     }
 
 
 class TraitLootOnAdd(TraitTarget):
+    # Lets tools/compile_injection_plan.py compile this variant's entries into injection plans.
+    PLAN_ITEM_TYPE = Types.ACTION
+
     FACTORY_TUNABLES = {
         'item_list': TunableList(
             description='List of loot tuning references.', 
@@ -795,42 +1028,47 @@ class TraitBuffs(TraitTarget):
     }
 
 
-class TraitBuffReplacements(TraitTarget):
-    FACTORY_TUNABLES = {
-        'item_list': TunableMapping(
-            description='A mapping of buff replacement. If Sim has this trait on, whenever he get the buff tuned in'
-                        ' the key of the mapping, it will get replaced by the value of the mapping.',
-            key_type=TunableReference(
-                description='Buff that will get replaced to apply on Sim by this trait.', 
+def _trait_buff_replacements_tunable():
+    return TunableMapping(
+        description='A mapping of buff replacement. If Sim has this trait on, whenever he get the buff tuned in'
+                    ' the key of the mapping, it will get replaced by the value of the mapping.',
+        key_type=TunableReference(
+            description='Buff that will get replaced to apply on Sim by this trait.', 
+            manager=services.buff_manager(), 
+            reload_dependent=True, 
+            pack_safe=True
+        ), 
+        value_type=TunableTuple(
+            description='Data specific to this buff replacement.', 
+            buff_type=TunableReference(
+                description='Buff used to replace the buff tuned as key.', 
                 manager=services.buff_manager(), 
                 reload_dependent=True, 
                 pack_safe=True
             ), 
-            value_type=TunableTuple(
-                description='Data specific to this buff replacement.', 
-                buff_type=TunableReference(
-                    description='Buff used to replace the buff tuned as key.', 
-                    manager=services.buff_manager(), 
-                    reload_dependent=True, 
-                    pack_safe=True
-                ), 
-                buff_reason=OptionalTunable(
-                    description='If enabled, override the buff reason.', 
-                    tunable=TunableLocalizedString(description='The overridden buff reason.')
-                ), 
-                buff_replacement_priority=TunableEnumEntry(
-                    description="The priority of this buff replacement, relative to other replacements. Tune this to "
-                                "be a higher value if you want this replacement to take precedence. e.g. (NORMAL) "
-                                "trait_HatesChildren (buff_FirstTrimester -> buff_FirstTrimester_HatesChildren) "
-                                "(HIGH) trait_Male (buff_FirstTrimester -> buff_FirstTrimester_Male) In this case, "
-                                "both traits have overrides on the pregnancy buffs. However, we don't want males "
-                                "impregnated by aliens that happen to hate children to lose their alien-specific "
-                                "buffs. Therefore we tune the male replacement at a higher priority.",
-                    tunable_type=TraitBuffReplacementPriority, 
-                    default=TraitBuffReplacementPriority.NORMAL
-                )
+            buff_reason=OptionalTunable(
+                description='If enabled, override the buff reason.', 
+                tunable=TunableLocalizedString(description='The overridden buff reason.')
+            ), 
+            buff_replacement_priority=TunableEnumEntry(
+                description="The priority of this buff replacement, relative to other replacements. Tune this to "
+                            "be a higher value if you want this replacement to take precedence. e.g. (NORMAL) "
+                            "trait_HatesChildren (buff_FirstTrimester -> buff_FirstTrimester_HatesChildren) "
+                            "(HIGH) trait_Male (buff_FirstTrimester -> buff_FirstTrimester_Male) In this case, "
+                            "both traits have overrides on the pregnancy buffs. However, we don't want males "
+                            "impregnated by aliens that happen to hate children to lose their alien-specific "
+                            "buffs. Therefore we tune the male replacement at a higher priority.",
+                tunable_type=TraitBuffReplacementPriority, 
+                default=TraitBuffReplacementPriority.NORMAL
             )
-        ),
+        )
+    )
+
+
+class TraitBuffReplacements(TraitTarget):
+    FACTORY_TUNABLES = {
+        'item_list': get_instance_target_tunable(Trait, 'buff_replacements', _trait_buff_replacements_tunable),
+        'merge_mode': TunableMergeMode(),
         'locked_args': {
             'injection_target_attr_str': 'buff_replacements',
             'is_xml_usable_variant': True
@@ -841,6 +1079,14 @@ class TraitBuffReplacements(TraitTarget):
 # interactions.base.interaction.Interaction
 
 class InteractionTarget(TuningRefVariantBase):
+    TARGET_INSTANCE_TYPE = Types.INTERACTION
+
+    def get_target_tunings(self):
+        return self._merge_target_tunings(
+            self.target_tuning_list,
+            tuning_index.AFFORDANCES_BY_TAG.select(self.target_tags)
+        )
+
     FACTORY_TUNABLES = {
         'target_tuning_list': TunableList(
             description='List of interaction tuning references.', 
@@ -850,6 +1096,15 @@ class InteractionTarget(TuningRefVariantBase):
                 allow_none=False,
                 pack_safe=True
             )
+        ),
+        'target_tags': TunableList(
+            description='Also target every interaction that has one of these tags in its interaction category tags.',
+            tunable=TunableEnumEntry(
+                tunable_type=Tag,
+                default=Tag.INVALID,
+                invalid_enums=(Tag.INVALID,),
+                pack_safe=True
+            )
         )
     }
 
@@ -912,3 +1167,72 @@ class InteractionHiddenFalseAdvertisements(InteractionTarget):
             'is_xml_usable_variant': True
         }
     }
+
+
+def _iter_subclasses(variant_cls):
+    for subclass in variant_cls.__subclasses__():
+        yield subclass
+        yield from _iter_subclasses(subclass)
+
+
+# Locked args are read from each class's own FACTORY_TUNABLES declaration,
+# with derived classes overriding their parents, same as the tuning does.
+def get_locked_args(variant_cls):
+    locked_args = {}
+    for base in reversed(variant_cls.__mro__):
+        factory_tunables = vars(base).get('FACTORY_TUNABLES')
+        if factory_tunables:
+            locked_args.update(factory_tunables.get('locked_args', {}))
+    return locked_args
+
+
+# The injection_timing a variant gets when the xml doesn't tune one.
+def get_default_injection_timing(variant_cls):
+    locked_args = get_locked_args(variant_cls)
+    if 'injection_timing' in locked_args:
+        return locked_args['injection_timing']
+    for base in variant_cls.__mro__:
+        factory_tunables = vars(base).get('FACTORY_TUNABLES')
+        if factory_tunables and 'injection_timing' in factory_tunables:
+            return factory_tunables['injection_timing'].default
+    return InjectionTiming.CRITICAL
+
+
+def get_xml_usable_variants(variant_base):
+    return tuple(
+        variant_cls for variant_cls in _iter_subclasses(variant_base)
+        if get_locked_args(variant_cls).get('is_xml_usable_variant', False)
+    )
+
+
+# Every module path the xml usable variants are locked to, in declaration order.
+def get_module_injection_target_strs():
+    target_strs = {}
+    for variant_cls in get_xml_usable_variants(ModuleVariantBase):
+        injection_target_str = get_locked_args(variant_cls).get('injection_target_str', '')
+        if injection_target_str:
+            target_strs[injection_target_str] = None
+    return tuple(target_strs)
+
+
+# Module paths of the variants that modify an existing item by key
+# (ex: AWAY_ACTIONS), which adds to the same path have to be ordered with.
+def get_keyed_module_injection_target_strs():
+    target_strs = {}
+    for variant_cls in get_xml_usable_variants(ModuleVariantBase):
+        if not any('key_ref' in vars(base).get('FACTORY_TUNABLES', {}) for base in variant_cls.__mro__):
+            continue
+        injection_target_str = get_locked_args(variant_cls).get('injection_target_str', '')
+        if injection_target_str:
+            target_strs[injection_target_str] = None
+    return tuple(target_strs)
+
+
+# Every instance type the tuning ref variants can target (ex: Types.BUFF).
+def get_tuning_ref_instance_types():
+    instance_types = {}
+    for variant_cls in _iter_subclasses(TuningRefVariantBase):
+        instance_type = getattr(variant_cls, 'TARGET_INSTANCE_TYPE', None)
+        if instance_type is not None:
+            instance_types[instance_type] = None
+    return tuple(instance_types)
@@ -0,0 +1,127 @@
+import mmap
+import os
+import traceback
+import services
+import sims4.log
+from sims4.resources import Types
+
+from temporal_module_injector import add_to_tuning
+from temporal_module_injector import profiling
+from temporal_module_injector import tracing
+from temporal_module_injector.factory_variants import InjectionTargetType
+from temporal_module_injector.injection_plan_format import read_plan, FILE_EXTENSION, KIND_MODULE_PATH, \
+    KIND_TUNING_REF_ATTR
+from temporal_module_injector.output_paths import get_injection_plan_dir
+from temporal_module_injector.touched_targets import touched_targets
+
+logger = sims4.log.Logger('TemporalModuleInjector')
+
+_KIND_TO_TARGET_TYPE = {
+    KIND_MODULE_PATH: InjectionTargetType.MODULE_PATH,
+    KIND_TUNING_REF_ATTR: InjectionTargetType.TUNING_REF_ATTR,
+}
+
+
+# Stands in for a factory variant instance, so plan entries go through
+# add_to_tuning exactly the same way as snippet entries do.
+class PlanInjection:
+    __slots__ = ('_injection_target_type', 'injection_target_str', 'injection_target_attr_str',
+                 'target_tuning_list', 'item_list')
+
+    is_xml_usable_variant = True
+
+    def __init__(self, injection_target_type, target, target_tuning_list, item_list):
+        self._injection_target_type = injection_target_type
+        self.injection_target_str = target if injection_target_type == InjectionTargetType.MODULE_PATH else ''
+        self.injection_target_attr_str = target if injection_target_type == InjectionTargetType.TUNING_REF_ATTR else ''
+        self.target_tuning_list = target_tuning_list
+        self.item_list = item_list
+
+    def get_injection_target_type(self):
+        return self._injection_target_type
+
+    def get_injection_target_label(self):
+        return self.injection_target_str or self.injection_target_attr_str
+
+    def get_target_tunings(self):
+        return self.target_tuning_list
+
+    # Plan targets come from the locked variant paths the compiler knows, not free xml.
+    def is_allowed_injection_target(self):
+        return True
+
+    def __repr__(self):
+        return '<PlanInjection:({})>'.format(self.get_injection_target_label())
+
+
+# Resolves every id of one resource type against its instance manager in one go,
+# dropping ids that don't resolve (same as pack_safe references do).
+class _BulkResolver:
+    def __init__(self):
+        self._managers = {}
+        self._resolved = {}
+
+    def resolve(self, type_name, instance_ids):
+        manager = self._managers.get(type_name)
+        if manager is None:
+            manager = services.get_instance_manager(Types[type_name])
+            self._managers[type_name] = manager
+        resolved = self._resolved.setdefault(type_name, {})
+        tunings = []
+        for instance_id in instance_ids:
+            tuning = resolved.get(instance_id)
+            if tuning is None and instance_id not in resolved:
+                tuning = manager.get(instance_id)
+                resolved[instance_id] = tuning
+            if tuning is not None:
+                tunings.append(tuning)
+        return tuple(tunings)
+
+
+def _read_plan_injections(plan_path, resolver):
+    with open(plan_path, 'rb') as plan_file:
+        if os.fstat(plan_file.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(plan_file.fileno(), 0, access=mmap.ACCESS_READ) as plan_buffer:
+            # Everything is resolved into tuning references before the mapping closes,
+            # nothing keeps a view of the buffer past this point.
+            return [
+                PlanInjection(
+                    _KIND_TO_TARGET_TYPE[record.kind],
+                    record.target,
+                    () if record.target_type is None else resolver.resolve(record.target_type, record.target_ids),
+                    resolver.resolve(record.item_type, record.item_ids)
+                )
+                for record in read_plan(plan_buffer)
+            ]
+
+
+# Only the plan folder itself is listed, not walked. Mods folders can hold thousands
+# of files in deep trees, and walking one would cost more than the plans save.
+def find_plan_files(plan_dir):
+    if not os.path.isdir(plan_dir):
+        return []
+    return sorted(
+        os.path.join(plan_dir, file_name) for file_name in os.listdir(plan_dir)
+        if file_name.endswith(FILE_EXTENSION)
+    )
+
+
+def load_injection_plans():
+    plan_dir = get_injection_plan_dir()
+    resolver = _BulkResolver()
+    for plan_path in find_plan_files(plan_dir):
+        plan_name = os.path.basename(plan_path)
+        logger.info('Processing injection plan {}', plan_name)
+        with profiling.profile_injection(plan_name), touched_targets.applying_snippet(plan_name), \
+                tracing.trace_span(plan_name, 'plan'):
+            try:
+                for plan_injection in _read_plan_injections(plan_path, resolver):
+                    if not plan_injection.item_list:
+                        logger.info('  {}: no items resolved, skipping', plan_injection.get_injection_target_label())
+                        continue
+                    with profiling.profile_injection(plan_name, plan_injection.get_injection_target_label()):
+                        add_to_tuning.add_items_to_list(plan_injection)
+            except:
+                logger.error('Exception occurred processing TemporalModuleInjector injection plan {}', plan_path)
+                logger.error(traceback.format_exc())
@@ -0,0 +1,149 @@
+# Compact binary injection plan format.
+#
+# A plan holds the same kind of injections as TMI snippet XML, but only for
+# variants whose items (and targets) are plain tuning references, so each entry
+# boils down to arrays of 64 bit instance ids. Plans are compiled offline from the
+# snippet XML (see tools/compile_injection_plan.py), which stays the source of
+# truth, and are read by TMI without going through the tunable system at all.
+#
+# This module has no game imports, so the offline tools can use it as well.
+#
+# Layout, all little-endian:
+#   header:       magic 'TMIP', u16 version, u16 reserved, u32 string count, u32 record count
+#   string table: per string, u16 byte length + utf-8 bytes, then padded to 8 bytes
+#   records:      per record, a 24 byte record header (see RECORD_HEADER) followed by
+#                 target_count u64 target ids and item_count u64 item ids
+# Strings are target paths (ex: 'clubs.club_tuning:ClubTunables:CLUB_TRAITS'),
+# tuning ref attrs (ex: '_loot_on_instance') and resource type names (ex: 'TRAIT').
+import array
+import struct
+import sys
+
+MAGIC = b'TMIP'
+VERSION = 1
+FILE_EXTENSION = '.tmiplan'
+
+HEADER = struct.Struct('<4sHHII')
+STRING_LENGTH = struct.Struct('<H')
+# target string index, item type string index, target type string index,
+# container kind tag, 3 bytes padding, target count, item count
+RECORD_HEADER = struct.Struct('<IIIB3xII')
+ID_SIZE = 8
+NO_STRING = 0xFFFFFFFF
+
+# Container kind tags, matching factory_variants.InjectionTargetType.
+KIND_MODULE_PATH = 1
+KIND_TUNING_REF_ATTR = 2
+
+
+class PlanRecord:
+    __slots__ = ('target', 'kind', 'item_type', 'target_type', 'target_ids', 'item_ids')
+
+    def __init__(self, target, kind, item_type, target_type, target_ids, item_ids):
+        self.target = target
+        self.kind = kind
+        self.item_type = item_type
+        self.target_type = target_type
+        self.target_ids = target_ids
+        self.item_ids = item_ids
+
+    def __repr__(self):
+        return '<PlanRecord:({}, {} target(s), {} item(s))>'.format(
+            self.target,
+            len(self.target_ids),
+            len(self.item_ids)
+        )
+
+
+def _pad(length):
+    return -length % ID_SIZE
+
+
+def _ids_to_bytes(ids):
+    packed = array.array('Q', ids)
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def write_plan(records, plan_file):
+    strings = {}
+
+    def string_index(value):
+        if value is None:
+            return NO_STRING
+        return strings.setdefault(value, len(strings))
+
+    record_headers = [
+        (
+            string_index(record.target),
+            string_index(record.item_type),
+            string_index(record.target_type),
+            record.kind
+        )
+        for record in records
+    ]
+    plan_file.write(HEADER.pack(MAGIC, VERSION, 0, len(strings), len(records)))
+    string_table_length = 0
+    for value in strings:
+        encoded = value.encode('utf-8')
+        plan_file.write(STRING_LENGTH.pack(len(encoded)))
+        plan_file.write(encoded)
+        string_table_length += STRING_LENGTH.size + len(encoded)
+    plan_file.write(b'\0' * _pad(HEADER.size + string_table_length))
+    for record, (target_index, item_type_index, target_type_index, kind) in zip(records, record_headers):
+        plan_file.write(RECORD_HEADER.pack(
+            target_index,
+            item_type_index,
+            target_type_index,
+            kind,
+            len(record.target_ids),
+            len(record.item_ids)
+        ))
+        plan_file.write(_ids_to_bytes(record.target_ids))
+        plan_file.write(_ids_to_bytes(record.item_ids))
+
+
+def _read_ids(view, offset, count):
+    ids = view[offset:offset + count * ID_SIZE]
+    if sys.byteorder != 'little':
+        swapped = array.array('Q', ids.tobytes())
+        swapped.byteswap()
+        return swapped
+    # Zero copy, the ids are read straight out of the (memory mapped) buffer.
+    return ids.cast('Q')
+
+
+# Yields PlanRecords whose id arrays are views into the buffer,
+# so the buffer must stay open until the records have been used.
+def read_plan(buffer):
+    view = memoryview(buffer)
+    magic, version, _, string_count, record_count = HEADER.unpack_from(view, 0)
+    if magic != MAGIC:
+        raise ValueError('Not a TMI injection plan (bad magic {!r})'.format(magic))
+    if version != VERSION:
+        raise ValueError('Unsupported TMI injection plan version {}'.format(version))
+    offset = HEADER.size
+    strings = []
+    for _ in range(string_count):
+        (length,) = STRING_LENGTH.unpack_from(view, offset)
+        offset += STRING_LENGTH.size
+        strings.append(bytes(view[offset:offset + length]).decode('utf-8'))
+        offset += length
+    offset += _pad(offset)
+    for _ in range(record_count):
+        target_index, item_type_index, target_type_index, kind, target_count, item_count = \
+            RECORD_HEADER.unpack_from(view, offset)
+        offset += RECORD_HEADER.size
+        target_ids = _read_ids(view, offset, target_count)
+        offset += target_count * ID_SIZE
+        item_ids = _read_ids(view, offset, item_count)
+        offset += item_count * ID_SIZE
+        yield PlanRecord(
+            strings[target_index],
+            kind,
+            strings[item_type_index],
+            None if target_type_index == NO_STRING else strings[target_type_index],
+            target_ids,
+            item_ids
+        )
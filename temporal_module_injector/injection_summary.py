@@ -0,0 +1,56 @@
+# Small records of what a TemporalModuleInjector snippet applied.
+# Once a snippet has been processed, these replace its staging data
+# (the factory variant instances and their item_list payloads),
+# which would otherwise be held for the whole session for nothing.
+
+ADD_ITEMS_TO_LIST = 'add_items_to_list'
+ADD_ITEMS_TO_EXISTING_LIST_ITEM = 'add_items_to_existing_list_item'
+REMOVE_ITEMS_FROM_LIST = 'remove_items_from_list'
+REPLACE_ITEMS_IN_LIST = 'replace_items_in_list'
+
+
+class AppliedInjection:
+    __slots__ = ('section', 'variant_name', 'target_label', 'item_count', 'target_count')
+
+    def __init__(self, section, variant_name, target_label, item_count, target_count):
+        self.section = section
+        self.variant_name = variant_name
+        self.target_label = target_label
+        self.item_count = item_count
+        self.target_count = target_count
+
+    @classmethod
+    def from_variant(cls, section, new_items, target_tunings=None):
+        get_target_tunings = getattr(new_items, 'get_target_tunings', None)
+        if target_tunings is None and get_target_tunings is not None:
+            target_tunings = get_target_tunings()
+        return cls(
+            section,
+            type(new_items).__name__,
+            new_items.get_injection_target_label(),
+            len(new_items.item_list),
+            1 if target_tunings is None else len(target_tunings)
+        )
+
+    def __repr__(self):
+        return '<AppliedInjection:({}, {}, {} item(s), {} target(s))>'.format(
+            self.variant_name,
+            self.target_label,
+            self.item_count,
+            self.target_count
+        )
+
+
+class AppliedSnippetSummary:
+    __slots__ = ('snippet_name', 'applied')
+
+    def __init__(self, snippet_name, applied):
+        self.snippet_name = snippet_name
+        self.applied = tuple(applied)
+
+    # For injections applied after the snippet was processed (ex: deferred ones).
+    def add_applied(self, applied_injection):
+        self.applied += (applied_injection,)
+
+    def __repr__(self):
+        return '<AppliedSnippetSummary:({}, {} injection(s))>'.format(self.snippet_name, len(self.applied))
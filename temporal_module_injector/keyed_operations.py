@@ -0,0 +1,82 @@
+import heapq
+
+from temporal_module_injector.structural_merge import is_hashable
+
+ADD = 0
+MODIFY = 1
+
+
+# One add or modify-existing operation queued for a keyed target
+# (ex: BABY_DEFAULT_BASSINETS, where modifies look up an existing item by trait).
+class PendingKeyedOperation:
+    __slots__ = ('kind', 'item_list', 'merge_mode', 'key_ref', 'key_str', 'value_str', 'sequence')
+
+    def __init__(self, kind, item_list, merge_mode, key_ref, key_str, value_str, sequence):
+        self.kind = kind
+        self.item_list = item_list
+        self.merge_mode = merge_mode
+        self.key_ref = key_ref
+        self.key_str = key_str
+        self.value_str = value_str
+        self.sequence = sequence
+
+    @classmethod
+    def add(cls, item_list, merge_mode, sequence):
+        return cls(ADD, item_list, merge_mode, None, '', '', sequence)
+
+    @classmethod
+    def modify(cls, item_list, key_ref, key_str, value_str, sequence):
+        return cls(MODIFY, item_list, None, key_ref, key_str, value_str, sequence)
+
+
+# Keys an add brings into the target: mapping keys, or for tuples of
+# ImmutableSlots, the values under key_str (ex: each bassinet entry's traits).
+def _get_introduced_keys(add_operation, key_str):
+    item_list = add_operation.item_list
+    if hasattr(item_list, 'keys'):
+        return set(key for key in item_list.keys() if is_hashable(key))
+    introduced_keys = set()
+    if not key_str:
+        return introduced_keys
+    for item in item_list:
+        for key in getattr(item, key_str, None) or ():
+            if is_hashable(key):
+                introduced_keys.add(key)
+    return introduced_keys
+
+
+# Orders one target's queued operations so every modify runs after each add that
+# introduces its key, however the snippets happened to load. Kahn's algorithm over
+# the add -> modify edges, with the queue order breaking ties, so operations that
+# don't depend on each other keep the order they were queued in. Adds never
+# depend on anything, so there's no cycle to break.
+def order_keyed_operations(operations):
+    adds_by_key = {}
+    dependents = {operation.sequence: [] for operation in operations}
+    in_degree = dict.fromkeys(dependents, 0)
+    for operation in operations:
+        if operation.kind != MODIFY or not is_hashable(operation.key_ref):
+            continue
+        if operation.key_str not in adds_by_key:
+            adds_by_key[operation.key_str] = {}
+            for add_operation in operations:
+                if add_operation.kind != ADD:
+                    continue
+                for key in _get_introduced_keys(add_operation, operation.key_str):
+                    adds_by_key[operation.key_str].setdefault(key, []).append(add_operation.sequence)
+        for add_sequence in adds_by_key[operation.key_str].get(operation.key_ref, ()):
+            dependents[add_sequence].append(operation.sequence)
+            in_degree[operation.sequence] += 1
+
+    operations_by_sequence = {operation.sequence: operation for operation in operations}
+    ready = [sequence for sequence, degree in in_degree.items() if degree == 0]
+    heapq.heapify(ready)
+    ordered = []
+    while ready:
+        sequence = heapq.heappop(ready)
+        ordered.append(operations_by_sequence[sequence])
+        for dependent_sequence in dependents[sequence]:
+            in_degree[dependent_sequence] -= 1
+            if in_degree[dependent_sequence] == 0:
+                heapq.heappush(ready, dependent_sequence)
+    return ordered
@@ -0,0 +1,60 @@
+import sims4.log
+
+from temporal_module_injector import profiling
+
+logger = sims4.log.Logger('TemporalModuleInjector')
+
+
+# Placeholder installed on a module target's class attribute when lazy
+# injection is enabled. Class attribute lookups go through __get__, so the
+# first read of the attribute (from the class or an instance of it) merges
+# the pending additions into the original value and puts the result back
+# on the class, replacing this placeholder for every later read.
+class LazyInjectedAttribute:
+    __slots__ = ('_owner', '_attr_name', '_injection_target_str', '_original', '_pending')
+
+    def __init__(self, owner, attr_name, injection_target_str, original):
+        self._owner = owner
+        self._attr_name = attr_name
+        self._injection_target_str = injection_target_str
+        self._original = original
+        self._pending = []
+
+    @property
+    def original_value(self):
+        return self._original
+
+    # Each pending merge takes the current value and returns the new value,
+    # or None if it had nothing to add (matching add_list_items_by_type).
+    def add_pending(self, merge):
+        self._pending.append(merge)
+
+    def materialize(self):
+        value = self._original
+        logger.info(
+            '  {}: materializing {} lazy injection(s)',
+            self._injection_target_str,
+            len(self._pending)
+        )
+        # Materializing is deferred injection work, so it counts towards the
+        # injection profile. The profile isn't written here, this runs on a
+        # gameplay attribute read, it's written at load complete (use
+        # tmi.dump_profile to write it again later).
+        with profiling.profile_injection(None, self._injection_target_str):
+            for merge in self._pending:
+                merged = merge(value)
+                if merged is not None:
+                    value = merged
+        setattr(self._owner, self._attr_name, value)
+        self._original = None
+        self._pending = None
+        return value
+
+    def __get__(self, instance, owner):
+        return self.materialize()
+
+    def __repr__(self):
+        return '<LazyInjectedAttribute:({}, pending={})>'.format(
+            self._injection_target_str,
+            0 if self._pending is None else len(self._pending)
+        )
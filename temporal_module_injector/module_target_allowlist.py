@@ -0,0 +1,38 @@
+import json
+import os
+import sims4.log
+import traceback
+from sims4.resources import Types
+
+logger = sims4.log.Logger('TemporalModuleInjector')
+
+# Module targets the generic allowlisted_module_target variant may inject into,
+# with the name of the instance type of the references each one holds (ex: TRAIT).
+# Adding a target that's a plain collection of tuning references only needs a line
+# in this file, rather than a new variant class in factory_variants.
+# Paths use the same module:Class:ATTR format as injection_target_str.
+# It's read through this module's loader so it also loads from inside the .ts4script archive.
+ALLOWLIST_FILE_NAME = 'module_target_allowlist.json'
+
+
+# The allowlist has to be read at import, since factory_variants builds the
+# allowlisted variant's reference options from its instance types.
+def load_allowed_module_targets():
+    try:
+        allowlist_path = os.path.join(os.path.dirname(__file__), ALLOWLIST_FILE_NAME)
+        allowlist = json.loads(__loader__.get_data(allowlist_path).decode('utf-8'))
+    except:
+        logger.error('Exception occurred reading {}', ALLOWLIST_FILE_NAME)
+        logger.error(traceback.format_exc())
+        return ()
+    allowed_targets = []
+    for injection_target_str, instance_type_name in allowlist.items():
+        instance_type = getattr(Types, str(instance_type_name), None)
+        if not isinstance(instance_type, Types):
+            logger.error('  {}: invalid instance type {}, ignoring it', injection_target_str, instance_type_name)
+            continue
+        allowed_targets.append((injection_target_str, instance_type))
+    return tuple(allowed_targets)
+
+
+ALLOWED_MODULE_TARGETS = load_allowed_module_targets()
@@ -0,0 +1,102 @@
+import sims4.log
+import sys
+
+from temporal_module_injector.module_target_allowlist import ALLOWED_MODULE_TARGETS
+
+logger = sims4.log.Logger('TemporalModuleInjector')
+
+
+# Resolves one module:Class:ATTR path to its class and attr name. The class is
+# looked up in sys.modules once and then kept, since the same targets get
+# resolved over and over (once per snippet, plus once per flush).
+class ModuleTargetResolver:
+    __slots__ = ('injection_target_str', 'module_str', 'class_str', 'attr_str', 'instance_type', '_target_class')
+
+    def __init__(self, injection_target_str, module_str, class_str, attr_str, instance_type=None):
+        self.injection_target_str = injection_target_str
+        self.module_str = module_str
+        self.class_str = class_str
+        self.attr_str = attr_str
+        # Only set for allowlisted targets, None for the hand-written variants' paths.
+        self.instance_type = instance_type
+        self._target_class = None
+
+    @property
+    def is_allowlisted(self):
+        return self.instance_type is not None
+
+    def resolve(self):
+        if self._target_class is None:
+            self._target_class = getattr(sys.modules[self.module_str], self.class_str)
+        return self._target_class, self.attr_str
+
+
+# Module targets kept as a trie of module -> class -> attr -> resolver.
+# Looking a path up is one split and three dict lookups, so validating
+# an xml path against the allowlist costs O(path length) however long
+# the allowlist gets.
+class ModuleTargetTrie:
+    __slots__ = ('_root',)
+
+    def __init__(self):
+        self._root = {}
+
+    @classmethod
+    def compile(cls, allowed_targets):
+        trie = cls()
+        for injection_target_str, instance_type in allowed_targets:
+            if trie.add(injection_target_str, instance_type) is None:
+                logger.error('  Invalid allowlisted module target: {}', injection_target_str)
+        return trie
+
+    @staticmethod
+    def _split(injection_target_str):
+        parts = injection_target_str.split(':')
+        if len(parts) != 3 or not all(parts):
+            return None
+        return parts
+
+    def add(self, injection_target_str, instance_type=None):
+        parts = self._split(injection_target_str)
+        if parts is None:
+            return None
+        module_str, class_str, attr_str = parts
+        attrs = self._root.setdefault(module_str, {}).setdefault(class_str, {})
+        resolver = attrs.get(attr_str)
+        if resolver is None:
+            resolver = ModuleTargetResolver(injection_target_str, module_str, class_str, attr_str, instance_type)
+            attrs[attr_str] = resolver
+        return resolver
+
+    def get(self, injection_target_str):
+        parts = self._split(injection_target_str)
+        if parts is None:
+            return None
+        module_str, class_str, attr_str = parts
+        return self._root.get(module_str, {}).get(class_str, {}).get(attr_str)
+
+    def get_allowlisted(self, injection_target_str):
+        resolver = self.get(injection_target_str)
+        if resolver is None or not resolver.is_allowlisted:
+            return None
+        return resolver
+
+    # Paths from the hand-written variants aren't allowlisted for the generic
+    # variant, they're only added here so they share the cached resolvers.
+    def get_or_add(self, injection_target_str):
+        resolver = self.get(injection_target_str)
+        if resolver is None:
+            resolver = self.add(injection_target_str)
+        return resolver
+
+    def get_allowlisted_instance_types(self):
+        instance_types = {}
+        for classes in self._root.values():
+            for attrs in classes.values():
+                for resolver in attrs.values():
+                    if resolver.is_allowlisted:
+                        instance_types[resolver.instance_type] = None
+        return tuple(instance_types)
+
+
+module_target_trie = ModuleTargetTrie.compile(ALLOWED_MODULE_TARGETS)
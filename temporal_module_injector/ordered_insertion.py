@@ -0,0 +1,94 @@
+import bisect
+
+from temporal_module_injector.factory_variants import InsertPosition
+from temporal_module_injector.structural_merge import is_hashable
+
+# Sort keys place each inserted item relative to the existing items, which sit
+# at (index, EXISTING). Inserting before an anchor goes just ahead of it,
+# inserting after goes just behind it, and ties between insertions at the same
+# spot go to the higher priority first, then to whichever was queued first.
+_BEFORE = 0
+_EXISTING = 1
+_AFTER = 2
+
+
+class PendingInsertion:
+    __slots__ = ('item_list', 'position', 'anchor', 'priority', 'sequence')
+
+    def __init__(self, item_list, position, anchor, priority, sequence):
+        self.item_list = item_list
+        self.position = position
+        self.anchor = anchor
+        self.priority = priority
+        self.sequence = sequence
+
+    @classmethod
+    def from_insert_position(cls, item_list, insert_position, sequence):
+        return cls(item_list, insert_position.position, insert_position.anchor, insert_position.priority, sequence)
+
+
+def _get_sort_key_base(insertion, position_index, existing_count):
+    if insertion.position == InsertPosition.START:
+        return -1, _AFTER
+    if insertion.position in (InsertPosition.BEFORE, InsertPosition.AFTER):
+        anchor_index = position_index.get(insertion.anchor) if is_hashable(insertion.anchor) else None
+        if anchor_index is not None:
+            return anchor_index, _BEFORE if insertion.position == InsertPosition.BEFORE else _AFTER
+        # Anchor isn't in the target (ex: from a pack the user doesn't own), go to the end.
+    return existing_count, _BEFORE
+
+
+# Merges every pending insertion for one ordered target in a single pass.
+# The position index of the existing items is built once, each new item is
+# bisected into a sorted list of insertions, and the result is built by walking
+# the existing items and the sorted insertions together. Returns the merged
+# container, or None if there was nothing new to add. Anchors that weren't found
+# are returned as well, for logging.
+def merge_ordered_insertions(existing, insertions):
+    is_mapping = not isinstance(existing, tuple)
+    existing_keys = tuple(existing.keys()) if is_mapping else existing
+    position_index = {}
+    for index, key in enumerate(existing_keys):
+        if is_hashable(key):
+            position_index.setdefault(key, index)
+
+    inserted = []
+    inserted_values = {}
+    missing_anchors = []
+    for insertion in insertions:
+        index, side = _get_sort_key_base(insertion, position_index, len(existing_keys))
+        if insertion.position in (InsertPosition.BEFORE, InsertPosition.AFTER) and index == len(existing_keys):
+            missing_anchors.append(insertion.anchor)
+        new_keys = tuple(insertion.item_list.keys()) if is_mapping else insertion.item_list
+        for item_index, key in enumerate(new_keys):
+            if key is None:
+                continue
+            hashable = is_hashable(key)
+            if hashable and (key in position_index or key in inserted_values):
+                if is_mapping:
+                    # Known key, its value is replaced where it already is.
+                    inserted_values[key] = insertion.item_list[key]
+                continue
+            if hashable:
+                inserted_values[key] = insertion.item_list[key] if is_mapping else None
+            sort_key = (index, side, -insertion.priority, insertion.sequence, item_index)
+            bisect.insort(inserted, (sort_key, key))
+
+    replaced_keys = [key for key in inserted_values if key in position_index]
+    if not inserted and not replaced_keys:
+        return None, missing_anchors
+
+    merged = []
+    inserted_index = 0
+    for index, key in enumerate(existing_keys):
+        while inserted_index < len(inserted) and inserted[inserted_index][0][:2] < (index, _EXISTING):
+            merged.append(inserted[inserted_index][1])
+            inserted_index += 1
+        merged.append(key)
+    merged.extend(entry[1] for entry in inserted[inserted_index:])
+
+    if is_mapping:
+        return type(existing)(
+            {key: inserted_values[key] if key in inserted_values else existing[key] for key in merged}
+        ), missing_anchors
+    return tuple(merged), missing_anchors
@@ -0,0 +1,64 @@
+import os
+import sims4.log
+
+from temporal_module_injector import settings
+
+logger = sims4.log.Logger('TemporalModuleInjector')
+
+MODS_DIR_NAME = 'Mods'
+
+_user_dir = None
+
+
+# The user folder is the parent of the Mods folder TMI is installed under (the
+# .ts4script sits somewhere below Mods, and __file__ points inside it). That
+# stays right when Documents is redirected (ex: to OneDrive) or the game folder
+# has a localized name. The usual default location is only a last resort.
+def _find_user_dir():
+    path = os.path.dirname(os.path.abspath(__file__))
+    while True:
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        if os.path.basename(path).lower() == MODS_DIR_NAME.lower():
+            return parent
+        path = parent
+    user_dir = os.path.join(os.path.expanduser('~'), 'Documents', 'Electronic Arts', 'The Sims 4')
+    logger.warn('TMI is not installed under a Mods folder, using {} as the user folder', user_dir)
+    return user_dir
+
+
+def get_user_dir():
+    global _user_dir
+    if _user_dir is None:
+        _user_dir = _find_user_dir()
+    return _user_dir
+
+
+def get_output_dir():
+    if settings.OUTPUT_DIR:
+        return settings.OUTPUT_DIR
+    return get_user_dir()
+
+
+# Folder TMI is installed in: the one holding its .ts4script or, unpacked, its package folder.
+def get_install_dir():
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if os.path.isfile(package_root):
+        return os.path.dirname(package_root)
+    return package_root
+
+
+def get_injection_plan_dir():
+    if settings.INJECTION_PLAN_DIR:
+        return settings.INJECTION_PLAN_DIR
+    return get_install_dir()
+
+
+# Only a configured OUTPUT_DIR is created, the user folder already exists
+# wherever the game is actually writing its logs.
+def get_output_path(file_name):
+    output_dir = get_output_dir()
+    if settings.OUTPUT_DIR:
+        os.makedirs(output_dir, exist_ok=True)
+    return os.path.join(output_dir, file_name)
@@ -0,0 +1,62 @@
+import cProfile
+import contextlib
+import io
+import pstats
+import traceback
+import sims4.log
+
+from temporal_module_injector import settings
+from temporal_module_injector.output_paths import get_output_path
+
+logger = sims4.log.Logger('TemporalModuleInjector')
+
+PSTATS_FILE_NAME = 'TMI_injection.pstats'
+SUMMARY_FILE_NAME = 'TMI_injection_profile.txt'
+
+# One profile is shared by every scope, so the dump covers the whole
+# injection phase (or everything in scope of it) rather than the last snippet.
+_profile = None
+_active = False
+
+
+def _is_in_scope(snippet_name, injection_target_str):
+    if settings.PROFILE_SNIPPETS and snippet_name not in settings.PROFILE_SNIPPETS:
+        return False
+    if settings.PROFILE_TARGETS and injection_target_str not in settings.PROFILE_TARGETS:
+        return False
+    return True
+
+
+# Scopes nest freely (ex: a snippet scope around its per-target scopes),
+# only the outermost scope in range actually enables the profiler.
+@contextlib.contextmanager
+def profile_injection(snippet_name, injection_target_str=None):
+    global _profile, _active
+    if not settings.PROFILE_ON or _active or not _is_in_scope(snippet_name, injection_target_str):
+        yield
+        return
+    if _profile is None:
+        _profile = cProfile.Profile()
+    _active = True
+    _profile.enable()
+    try:
+        yield
+    finally:
+        _profile.disable()
+        _active = False
+
+
+def dump_profile():
+    if _profile is None:
+        return
+    try:
+        stats = pstats.Stats(_profile)
+        stats.dump_stats(get_output_path(PSTATS_FILE_NAME))
+        summary = io.StringIO()
+        pstats.Stats(_profile, stream=summary).sort_stats('cumulative').print_stats(settings.PROFILE_TOP_N)
+        with open(get_output_path(SUMMARY_FILE_NAME), 'w') as summary_file:
+            summary_file.write(summary.getvalue())
+        logger.info('Wrote injection profile to {}', get_output_path(PSTATS_FILE_NAME))
+    except:
+        logger.error('Exception occurred writing TemporalModuleInjector profile')
+        logger.error(traceback.format_exc())
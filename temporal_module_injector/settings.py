@@ -6,4 +6,76 @@
 # information 'noise' in logging when investigating live issues.
 # Most live issues are likely going to be caused by patch changes
 # and we don't want a massive info dump log file to sift through.
-DEBUG_ON = True
\ No newline at end of file
+DEBUG_ON = True
+
+# Lazy injection installs a placeholder on module targets instead of
+# rebuilding them at load. The placeholder holds the original value and
+# the pending additions, and builds the merged container on first access.
+# Targets that are never read in a session never pay for the merge.
+# Leave LAZY_INJECTION_TARGETS empty to apply this to every module target,
+# or list injection_target_str paths to limit it to those targets only.
+LAZY_INJECTION_ON = False
+LAZY_INJECTION_TARGETS = frozenset()
+
+
+# Where TMI writes its own output files (profiles, reports, etc.).
+# Left empty, this is the Sims 4 user folder, which is where the game
+# writes its own logs and exception files.
+OUTPUT_DIR = ''
+
+
+# Profiling wraps the injection phase in cProfile and, once snippets finish
+# loading, writes TMI_injection.pstats plus a top PROFILE_TOP_N text summary
+# to OUTPUT_DIR. Scope it with snippet names (ex: 'Triplis:TemporalModuleInjector_X')
+# and/or target paths/attrs (ex: 'clubs.club_tuning:ClubTunables:CLUB_TRAITS' or
+# '_loot_on_instance'). Leave both empty to profile everything.
+PROFILE_ON = False
+PROFILE_SNIPPETS = frozenset()
+PROFILE_TARGETS = frozenset()
+PROFILE_TOP_N = 40
+
+
+# Injection plans are compact binary files compiled offline from snippet XML
+# (see tools/compile_injection_plan.py). When enabled, every .tmiplan file directly
+# in INJECTION_PLAN_DIR (subfolders aren't searched) is loaded once snippets finish
+# loading. Left empty, that is the folder TMI's .ts4script is installed in.
+# Plans are always applied at that point, variants that default to DEFERRED
+# (ex: club_seeds_secondary) can't be compiled into them.
+INJECTION_PLANS_ON = False
+INJECTION_PLAN_DIR = ''
+
+
+# Deferred injections (see factory_variants.InjectionTiming) run after the first
+# zone has loaded, in slices of at most DEFERRED_SLICE_BUDGET_MS each, with
+# DEFERRED_SLICE_INTERVAL_MS of real time between slices. A single injection
+# is never split, so one slice can go over budget by at most one injection.
+DEFERRED_SLICE_BUDGET_MS = 4
+DEFERRED_SLICE_INTERVAL_MS = 50
+
+
+# The autonomy cost report counts the advertisements (static commodities and
+# false advertisements) TMI adds to each affordance, and flags affordances that
+# gained more than AUTONOMY_AD_GROWTH_THRESHOLD ads. With AUTONOMY_SAMPLING_ON,
+# calls to the autonomy scoring function at AUTONOMY_SAMPLING_HOOK are also
+# counted for the affordances TMI added ads to.
+AUTONOMY_AD_GROWTH_THRESHOLD = 5
+AUTONOMY_SAMPLING_ON = False
+AUTONOMY_SAMPLING_HOOK = 'autonomy.autonomy_modes:FullAutonomy:_create_and_score_interaction'
+
+
+# Target snapshots hash the final value of every target TMI touched (order-aware,
+# tuning references by guid64) and write them to TMI_target_snapshot.txt in
+# OUTPUT_DIR once snippets finish loading, and again once deferred injections
+# finish. With TARGET_SNAPSHOT_COMPARE_ON, each snapshot is compared against
+# TMI_target_snapshot_baseline.txt and changed targets are logged. Save a known
+# good snapshot as the baseline with the tmi.snapshot_save_baseline command.
+# Taking a snapshot reads every touched target, so it materializes lazy targets.
+TARGET_SNAPSHOT_ON = False
+TARGET_SNAPSHOT_COMPARE_ON = False
+
+
+# Tracing records nested spans for snippet callbacks, target resolutions,
+# container merges and ImmutableSlots clones, and writes them to
+# TMI_injection_trace.json in OUTPUT_DIR once snippets finish loading (and again
+# once deferred injections finish). Open it in chrome://tracing or Perfetto.
+TRACE_ON = False
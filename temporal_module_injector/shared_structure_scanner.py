@@ -0,0 +1,171 @@
+import services
+import sims4.log
+from sims4.collections import _ImmutableSlotsBase
+import sys
+
+from temporal_module_injector import factory_variants
+from temporal_module_injector.lazy_attribute import LazyInjectedAttribute
+
+logger = sims4.log.Logger('TemporalModuleInjector')
+
+
+# See TheCachingProblem.md. ImmutableSlots can be cached and handed out to
+# more than one tuning instance or module attribute, in which case changing
+# one owner's ImmutableSlots (ex: with clone_with_overrides) changes the others.
+# The scanner walks everything TMI can target and reports which ImmutableSlots
+# objects are reachable from more than one owner.
+class SharedStructure:
+    __slots__ = ('obj', 'owners', 'estimated_size')
+
+    def __init__(self, obj, owners, estimated_size):
+        self.obj = obj
+        self.owners = owners
+        self.estimated_size = estimated_size
+
+    def __repr__(self):
+        return '<SharedStructure:({}, owners={}, ~{} bytes)>'.format(
+            type(self.obj).__name__,
+            len(self.owners),
+            self.estimated_size
+        )
+
+
+def _iter_children(value):
+    if isinstance(value, _ImmutableSlotsBase):
+        for slot_name in getattr(type(value), '__slots__', ()):
+            yield getattr(value, slot_name, None)
+    elif isinstance(value, (str, bytes, type)):
+        # Tuning references (classes) are owners in their own right,
+        # and strings have nothing worth walking into.
+        return
+    elif isinstance(value, dict):
+        yield from value.keys()
+        yield from value.values()
+    elif isinstance(value, (tuple, list, set, frozenset)):
+        yield from value
+
+
+def _get_module_target_owners():
+    for injection_target_str in factory_variants.get_module_injection_target_strs():
+        module_str, class_str, attr_str = injection_target_str.split(':')
+        module = sys.modules.get(module_str)
+        target_class = getattr(module, class_str, None)
+        if target_class is None:
+            continue
+        value = vars(target_class).get(attr_str)
+        if isinstance(value, LazyInjectedAttribute):
+            # Scanning shouldn't be what makes a lazy target materialize.
+            value = value.original_value
+        elif value is None:
+            value = getattr(target_class, attr_str, None)
+        yield injection_target_str, value
+
+
+def _get_tunable_names(tuning):
+    get_tunables = getattr(tuning, 'get_tunables', None)
+    if get_tunables is not None:
+        return get_tunables().keys()
+    return getattr(tuning, 'INSTANCE_TUNABLES', {}).keys()
+
+
+def _get_tuning_ref_owners():
+    for instance_type in factory_variants.get_tuning_ref_instance_types():
+        manager = services.get_instance_manager(instance_type)
+        for tuning in manager.types.values():
+            for attr_name in _get_tunable_names(tuning):
+                value = getattr(tuning, attr_name, None)
+                if value is not None:
+                    yield '{}:{}'.format(tuning.__name__, attr_name), value
+
+
+def _estimate_size(obj, shared_ids):
+    # Deep size of the object, not counting anything that is itself shared
+    # (that is reported separately) or tuning references.
+    size = 0
+    visited = set()
+    stack = [obj]
+    while stack:
+        value = stack.pop()
+        value_id = id(value)
+        if value_id in visited:
+            continue
+        visited.add(value_id)
+        size += sys.getsizeof(value)
+        for child in _iter_children(value):
+            if isinstance(child, type) or id(child) in shared_ids:
+                continue
+            stack.append(child)
+    return size
+
+
+# ImmutableSlots nested anywhere under slots_obj, by id. Memoized per object,
+# so a structure reached from many owners is only ever walked once.
+def _get_nested_slots(slots_obj, nested_by_id):
+    nested = nested_by_id.get(id(slots_obj))
+    if nested is not None:
+        return nested
+    nested = {}
+    visited = set()
+    stack = list(_iter_children(slots_obj))
+    while stack:
+        current = stack.pop()
+        current_id = id(current)
+        if current_id in visited:
+            continue
+        visited.add(current_id)
+        if isinstance(current, _ImmutableSlotsBase):
+            nested[current_id] = current
+            nested.update(_get_nested_slots(current, nested_by_id))
+            continue
+        stack.extend(_iter_children(current))
+    nested_by_id[id(slots_obj)] = nested
+    return nested
+
+
+def scan_shared_structures():
+    # id(slots object) -> (slots object, [owner labels])
+    # Every ImmutableSlots an owner can reach is recorded against it, nested
+    # ones included, since a nested object can be shared even when the objects
+    # above it aren't. What's under each ImmutableSlots is only walked once
+    # (see _get_nested_slots), which keeps the scan linear over the tuning.
+    index = {}
+    nested_by_id = {}
+    owner_count = 0
+    for owners in (_get_module_target_owners(), _get_tuning_ref_owners()):
+        for owner_label, value in owners:
+            owner_count += 1
+            owned = {}
+            visited = set()
+            stack = [value]
+            while stack:
+                current = stack.pop()
+                current_id = id(current)
+                if current_id in visited:
+                    continue
+                visited.add(current_id)
+                if isinstance(current, _ImmutableSlotsBase):
+                    owned[current_id] = current
+                    owned.update(_get_nested_slots(current, nested_by_id))
+                    continue
+                stack.extend(_iter_children(current))
+            for obj_id, obj in owned.items():
+                indexed = index.get(obj_id)
+                if indexed is None:
+                    index[obj_id] = (obj, [owner_label])
+                else:
+                    indexed[1].append(owner_label)
+
+    shared_ids = set(obj_id for obj_id, (_, owners) in index.items() if len(owners) > 1)
+    shared = [
+        SharedStructure(index[obj_id][0], tuple(index[obj_id][1]), _estimate_size(index[obj_id][0], shared_ids))
+        for obj_id in shared_ids
+    ]
+    shared.sort(key=lambda structure: (len(structure.owners), structure.estimated_size), reverse=True)
+    logger.info(
+        'Shared structure scan: {} owners, {} ImmutableSlots, {} shared by more than one owner (~{} bytes)',
+        owner_count,
+        len(index),
+        len(shared),
+        sum(structure.estimated_size for structure in shared)
+    )
+    return shared
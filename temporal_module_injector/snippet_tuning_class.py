@@ -4,13 +4,60 @@ from sims4.resources import Types
 from sims4.tuning.instances import HashedTunedInstanceMetaclass
 from sims4.tuning.tunable import HasTunableReference, TunableVariant, TunableList, TunableTuple, Tunable
 import traceback
+import functools
 
 from temporal_module_injector import factory_variants
 from temporal_module_injector import add_to_tuning
+from temporal_module_injector import autonomy_cost_report
+# Imported so the console commands get registered along with the snippet class.
+from temporal_module_injector import commands
+from temporal_module_injector import injection_plan
+from temporal_module_injector import profiling
+from temporal_module_injector import settings
+from temporal_module_injector import target_snapshot
+from temporal_module_injector import tracing
+from temporal_module_injector import tuning_index
+from temporal_module_injector.content_fingerprint import duplicate_entry_filter
+from temporal_module_injector.deferred_injection import deferred_injection_scheduler
+from temporal_module_injector.injection_summary import AppliedInjection, AppliedSnippetSummary, ADD_ITEMS_TO_LIST, \
+    ADD_ITEMS_TO_EXISTING_LIST_ITEM, REMOVE_ITEMS_FROM_LIST, REPLACE_ITEMS_IN_LIST
+from temporal_module_injector.touched_targets import touched_targets
 
 logger = sims4.log.Logger('TemporalModuleInjector')
 
 
+# Every variant that can be added to (or removed from) a list,
+# shared between the add, remove and replace sections.
+def _list_item_variants():
+    return TunableVariant(
+        pregnancy_origin_modifiers=factory_variants.PregnancyOriginModifiers.TunableFactory(),
+        baby_bassinet_definition_map=factory_variants.BabyBassinetDefinitionMap.TunableFactory(),
+        baby_cloth_state_map=factory_variants.BabyClothStateMap.TunableFactory(),
+        baby_default_bassinets=factory_variants.BabyDefaultBassinets.TunableFactory(),
+        buck_type_to_tracker_map=factory_variants.BuckTypeToTrackerMap.TunableFactory(),
+        club_traits=factory_variants.ClubTraits.TunableFactory(),
+        club_seeds_secondary=factory_variants.ClubSeedsSecondary.TunableFactory(),
+        bucket_scoring_rules=factory_variants.BucketScoringRules.TunableFactory(),
+        ensemble_priorities=factory_variants.EnsemblePriorities.TunableFactory(),
+        lifestyles=factory_variants.Lifestyles.TunableFactory(),
+        hidden_lifestyles=factory_variants.HiddenLifestyles.TunableFactory(),
+        default_away_action=factory_variants.DefaultAwayAction.TunableFactory(),
+        teleport_data_mapping=factory_variants.TeleportDataMapping.TunableFactory(),
+        trait_inheritance=factory_variants.TraitInheritance.TunableFactory(),
+        satisfaction_store_items=factory_variants.SatisfactionStoreItems.TunableFactory(),
+        allowlisted_module_target=factory_variants.AllowlistedModuleTarget.TunableFactory(),
+        buff_loot_on_instance=factory_variants.BuffLootOnInstance.TunableFactory(),
+        buff_loot_on_addition=factory_variants.BuffLootOnAdd.TunableFactory(),
+        buff_loot_on_removal=factory_variants.BuffLootOnRemove.TunableFactory(),
+        trait_loot_on_trait_add=factory_variants.TraitLootOnAdd.TunableFactory(),
+        trait_buffs=factory_variants.TraitBuffs.TunableFactory(),
+        trait_buff_replacements=factory_variants.TraitBuffReplacements.TunableFactory(),
+        interaction_static_commodities=factory_variants.InteractionStaticCommodities.TunableFactory(),
+        interaction_false_advertisements=factory_variants.InteractionFalseAdvertisements.TunableFactory(),
+        interaction_hidden_false_advertisements=factory_variants.InteractionHiddenFalseAdvertisements.TunableFactory()
+    )
+
+
 class TemporalModuleInjector(
     HasTunableReference, 
     metaclass=HashedTunedInstanceMetaclass, 
@@ -20,32 +67,7 @@ class TemporalModuleInjector(
         'add_items_to_list': TunableList(
             description='A list of new items and injection target pairings.',
             tunable=TunableTuple(
-                new_items=TunableVariant(
-                    pregnancy_origin_modifiers=factory_variants.PregnancyOriginModifiers.TunableFactory(),
-                    baby_bassinet_definition_map=factory_variants.BabyBassinetDefinitionMap.TunableFactory(),
-                    baby_cloth_state_map=factory_variants.BabyClothStateMap.TunableFactory(),
-                    baby_default_bassinets=factory_variants.BabyDefaultBassinets.TunableFactory(),
-                    buck_type_to_tracker_map=factory_variants.BuckTypeToTrackerMap.TunableFactory(),
-                    club_traits=factory_variants.ClubTraits.TunableFactory(),
-                    club_seeds_secondary=factory_variants.ClubSeedsSecondary.TunableFactory(),
-                    bucket_scoring_rules=factory_variants.BucketScoringRules.TunableFactory(),
-                    ensemble_priorities=factory_variants.EnsemblePriorities.TunableFactory(),
-                    lifestyles=factory_variants.Lifestyles.TunableFactory(),
-                    hidden_lifestyles=factory_variants.HiddenLifestyles.TunableFactory(),
-                    default_away_action=factory_variants.DefaultAwayAction.TunableFactory(),
-                    teleport_data_mapping=factory_variants.TeleportDataMapping.TunableFactory(),
-                    trait_inheritance=factory_variants.TraitInheritance.TunableFactory(),
-                    satisfaction_store_items=factory_variants.SatisfactionStoreItems.TunableFactory(),
-                    buff_loot_on_instance=factory_variants.BuffLootOnInstance.TunableFactory(),
-                    buff_loot_on_addition=factory_variants.BuffLootOnAdd.TunableFactory(),
-                    buff_loot_on_removal=factory_variants.BuffLootOnRemove.TunableFactory(),
-                    trait_loot_on_trait_add=factory_variants.TraitLootOnAdd.TunableFactory(),
-                    trait_buffs=factory_variants.TraitBuffs.TunableFactory(),
-                    trait_buff_replacements=factory_variants.TraitBuffReplacements.TunableFactory(),
-                    interaction_static_commodities=factory_variants.InteractionStaticCommodities.TunableFactory(),
-                    interaction_false_advertisements=factory_variants.InteractionFalseAdvertisements.TunableFactory(),
-                    interaction_hidden_false_advertisements=factory_variants.InteractionHiddenFalseAdvertisements.TunableFactory()
-                )
+                new_items=_list_item_variants()
             )
         ),
         'add_items_to_existing_list_item': TunableList(
@@ -56,35 +78,167 @@ class TemporalModuleInjector(
                     away_actions=factory_variants.AwayActionsExistingKey.TunableFactory(),
                 )
             )
+        ),
+        'remove_items_from_list': TunableList(
+            description='A list of items to remove and injection target pairings. For mappings, the items with the '
+                        'same keys are removed.',
+            tunable=TunableTuple(
+                removed_items=_list_item_variants()
+            )
+        ),
+        'replace_items_in_list': TunableList(
+            description='A list of items to replace and injection target pairings. Each item in replaced_items is '
+                        'replaced by the item at the same position in new_items, both must be the same variant. '
+                        'The targets are taken from new_items.',
+            tunable=TunableTuple(
+                replaced_items=_list_item_variants(),
+                new_items=_list_item_variants()
+            )
         )
     }
 
+    applied_summary = None
+
     @classmethod
     def _tuning_loaded_callback(cls):
         logger.info('Processing {}', str(cls))
-        try:
-            for entry in cls.add_items_to_list:
-                if entry.new_items.item_list is None:
-                    logger.warn('Tuning warning, missing or invalid items')
-                else:
-                    add_to_tuning.add_items_to_list(entry.new_items)
-            for entry in cls.add_items_to_existing_list_item:
-                if entry.new_items.item_list is None:
-                    logger.warn('Tuning warning, missing or invalid items')
-                else:
-                    add_to_tuning.add_items_to_existing_list_item(
-                        entry.new_items.item_list, 
-                        entry.new_items.key_ref, 
-                        entry.new_items.key_str, 
-                        entry.new_items.value_str, 
-                        entry.new_items.injection_target_str
+        applied = []
+        with profiling.profile_injection(cls.__name__), touched_targets.applying_snippet(cls.__name__), \
+                tracing.trace_span(cls.__name__, 'snippet') as span_args:
+            if span_args is not None:
+                span_args.update(
+                    add_items_to_list=len(cls.add_items_to_list),
+                    add_items_to_existing_list_item=len(cls.add_items_to_existing_list_item),
+                    remove_items_from_list=len(cls.remove_items_from_list),
+                    replace_items_in_list=len(cls.replace_items_in_list)
+                )
+            try:
+                for entry in cls.add_items_to_list:
+                    if entry.new_items.item_list is None:
+                        logger.warn('Tuning warning, missing or invalid items')
+                        continue
+                    fingerprint = duplicate_entry_filter.get_unapplied_fingerprint(
+                        cls.__name__,
+                        ADD_ITEMS_TO_LIST,
+                        entry.new_items
+                    )
+                    if fingerprint is None:
+                        continue
+                    if entry.new_items.injection_timing == factory_variants.InjectionTiming.DEFERRED:
+                        # Tuning ref targets are resolved now, while the selector indexes are still
+                        # built, so a deferred slice never has to scan a whole instance manager again.
+                        get_target_tunings = getattr(entry.new_items, 'get_target_tunings', None)
+                        target_tunings = None if get_target_tunings is None else get_target_tunings()
+                        deferred_injection_scheduler.add(
+                            entry.new_items.get_injection_target_label(),
+                            touched_targets.bind_snippet(
+                                cls.__name__,
+                                functools.partial(cls._apply_deferred, entry.new_items, fingerprint, target_tunings)
+                            )
+                        )
+                    else:
+                        with profiling.profile_injection(cls.__name__, entry.new_items.get_injection_target_label()):
+                            add_to_tuning.add_items_to_list(entry.new_items)
+                        duplicate_entry_filter.mark_applied(fingerprint, cls.__name__)
+                        applied.append(AppliedInjection.from_variant(ADD_ITEMS_TO_LIST, entry.new_items))
+                for entry in cls.add_items_to_existing_list_item:
+                    if entry.new_items.item_list is None:
+                        logger.warn('Tuning warning, missing or invalid items')
+                        continue
+                    fingerprint = duplicate_entry_filter.get_unapplied_fingerprint(
+                        cls.__name__,
+                        ADD_ITEMS_TO_EXISTING_LIST_ITEM,
+                        entry.new_items
                     )
-        except:
-            logger.error('Exception occurred processing TemporalModuleInjector tuning instance {}', str(cls))
-            logger.error(traceback.format_exc())
+                    if fingerprint is None:
+                        continue
+                    with profiling.profile_injection(cls.__name__, entry.new_items.get_injection_target_label()):
+                        add_to_tuning.add_items_to_existing_list_item(
+                            entry.new_items.item_list, 
+                            entry.new_items.key_ref, 
+                            entry.new_items.key_str, 
+                            entry.new_items.value_str, 
+                            entry.new_items.injection_target_str
+                        )
+                    duplicate_entry_filter.mark_applied(fingerprint, cls.__name__)
+                    applied.append(AppliedInjection.from_variant(ADD_ITEMS_TO_EXISTING_LIST_ITEM, entry.new_items))
+                for entry in cls.remove_items_from_list:
+                    if entry.removed_items.item_list is None:
+                        logger.warn('Tuning warning, missing or invalid items')
+                    else:
+                        add_to_tuning.remove_items_from_list(entry.removed_items)
+                        applied.append(AppliedInjection.from_variant(REMOVE_ITEMS_FROM_LIST, entry.removed_items))
+                for entry in cls.replace_items_in_list:
+                    if entry.replaced_items.item_list is None or entry.new_items.item_list is None:
+                        logger.warn('Tuning warning, missing or invalid items')
+                    else:
+                        add_to_tuning.replace_items_in_list(entry.replaced_items, entry.new_items)
+                        applied.append(AppliedInjection.from_variant(REPLACE_ITEMS_IN_LIST, entry.new_items))
+            except:
+                logger.error('Exception occurred processing TemporalModuleInjector tuning instance {}', str(cls))
+                logger.error(traceback.format_exc())
+        cls._compact_staging_data(applied)
+
+    # Deferred entries are only recorded as applied once they've actually run.
+    @classmethod
+    def _apply_deferred(cls, new_items, fingerprint, target_tunings):
+        add_to_tuning.add_items_to_list(new_items, target_tunings)
+        duplicate_entry_filter.mark_applied(fingerprint, cls.__name__)
+        cls.applied_summary.add_applied(AppliedInjection.from_variant(ADD_ITEMS_TO_LIST, new_items, target_tunings))
+
+    # The staging tuples hold every factory variant and item_list payload,
+    # none of which is needed once injected, so swap them for a small summary.
+    @classmethod
+    def _compact_staging_data(cls, applied):
+        cls.applied_summary = AppliedSnippetSummary(cls.__name__, applied)
+        cls.add_items_to_list = ()
+        cls.add_items_to_existing_list_item = ()
+        cls.remove_items_from_list = ()
+        cls.replace_items_in_list = ()
 
     def __repr__(self):
         return '<TemporalModuleInjector:({})>'.format(self.__name__)
 
     def __str__(self):
         return '{}'.format(self.__name__)
+
+
+# Runs once every snippet (and so every TemporalModuleInjector) has been loaded,
+# which is the end of the injection phase.
+def _on_snippets_loaded(manager):
+    try:
+        add_to_tuning.flush_ordered_insertions()
+    except:
+        logger.error('Exception occurred merging TemporalModuleInjector ordered insertions')
+        logger.error(traceback.format_exc())
+    if settings.INJECTION_PLANS_ON:
+        injection_plan.load_injection_plans()
+    # Adds and modify-existing operations on keyed targets, after plans since those can add keys too.
+    try:
+        add_to_tuning.flush_keyed_operations()
+    except:
+        logger.error('Exception occurred applying TemporalModuleInjector keyed operations')
+        logger.error(traceback.format_exc())
+    # Removals go last, so they can also remove items other snippets added.
+    try:
+        add_to_tuning.flush_removals()
+    except:
+        logger.error('Exception occurred applying TemporalModuleInjector removals')
+        logger.error(traceback.format_exc())
+    # Selector indexes are only needed while snippets load, drop them rather than holding
+    # every index for the session. Deferred entries resolved their selectors when queued.
+    tuning_index.clear_indexes()
+    duplicate_entry_filter.log_summary()
+    logger.info('Container rebuilds: {}', add_to_tuning.rebuild_counters.get_summary())
+    autonomy_cost_report.log_report()
+    if settings.AUTONOMY_SAMPLING_ON:
+        autonomy_cost_report.install_scoring_sampler()
+    if settings.TARGET_SNAPSHOT_ON:
+        target_snapshot.write_and_compare()
+    if settings.PROFILE_ON:
+        profiling.dump_profile()
+    if settings.TRACE_ON:
+        tracing.dump_trace()
+
+
+services.get_instance_manager(Types.SNIPPET).add_on_load_complete(_on_snippets_loaded)
@@ -0,0 +1,93 @@
+from sims4.collections import FrozenAttributeDict
+from _sims4_collections import frozendict
+from sims4.collections import _ImmutableSlotsBase
+
+from temporal_module_injector import tracing
+
+
+def is_hashable(item):
+    try:
+        hash(item)
+    except TypeError:
+        return False
+    return True
+
+
+def _get_slot_names(slots_obj):
+    return getattr(type(slots_obj), '__slots__', ())
+
+
+# Merges new into existing for nested values (ex: a PregnancyOriginModifiers
+# value with its trait_entries), rebuilding only the parts of the structure that
+# actually change. Everything that doesn't change is shared with the original,
+# and if nothing changes at all the existing object itself is returned, so callers
+# can check 'merged is existing' to skip writing anything back.
+#
+# Existing ImmutableSlots are never modified in place, changes go through
+# clone_with_overrides, so this is safe with ImmutableSlots that are shared
+# between owners (see TheCachingProblem.md).
+#
+#   tuples:        new items not already present are appended
+#   frozensets:    union
+#   mappings:      merged key by key
+#   ImmutableSlots: merged field by field
+#   anything else: the existing value is kept
+#
+# Scalars (and values whose type changed) keep the existing value, since an
+# untouched field in the new value is just the tunable's default (ex: a snippet
+# only adding trait_entries would otherwise reset a tuned chance or weight).
+# Overwriting values is what the REPLACE merge mode is for.
+def deep_merge(existing, new):
+    if new is None or new is existing:
+        return existing
+    if existing is None:
+        return new
+    if isinstance(existing, _ImmutableSlotsBase) and isinstance(new, _ImmutableSlotsBase):
+        slot_names = _get_slot_names(existing)
+        if slot_names != _get_slot_names(new):
+            return existing
+        overrides = {}
+        for slot_name in slot_names:
+            existing_value = getattr(existing, slot_name)
+            merged_value = deep_merge(existing_value, getattr(new, slot_name))
+            if merged_value is not existing_value:
+                overrides[slot_name] = merged_value
+        if not overrides:
+            return existing
+        with tracing.trace_span(type(existing).__name__, 'clone') as span_args:
+            if span_args is not None:
+                span_args['overrides'] = tuple(overrides)
+            return existing.clone_with_overrides(**overrides)
+    existing_type = type(existing)
+    if existing_type != type(new):
+        return existing
+    if existing_type == tuple:
+        existing_items = set(item for item in existing if is_hashable(item))
+        additions = tuple(item for item in new if not (is_hashable(item) and item in existing_items))
+        if not additions:
+            return existing
+        return existing + additions
+    if existing_type == frozenset:
+        if new <= existing:
+            return existing
+        return existing | new
+    if existing_type == frozendict or existing_type == FrozenAttributeDict:
+        changes = merge_mapping_values(existing, new)
+        if not changes:
+            return existing
+        return existing_type({**dict(existing), **changes})
+    return existing
+
+
+# Only the keys whose merged value differs from the existing value.
+def merge_mapping_values(existing_mapping, new_mapping):
+    changes = {}
+    for key, new_value in new_mapping.items():
+        if key in existing_mapping:
+            existing_value = existing_mapping[key]
+            merged_value = deep_merge(existing_value, new_value)
+            if merged_value is not existing_value:
+                changes[key] = merged_value
+        else:
+            changes[key] = new_value
+    return changes
@@ -0,0 +1,68 @@
+import itertools
+
+from temporal_module_injector.lazy_attribute import LazyInjectedAttribute
+
+# Longest value shown per line, so one deep tuple can't flood the console.
+MAX_VALUE_LENGTH = 200
+
+
+def format_value(value):
+    value_str = str(value)
+    if len(value_str) > MAX_VALUE_LENGTH:
+        return value_str[:MAX_VALUE_LENGTH - 3] + '...'
+    return value_str
+
+
+def get_target_size(value):
+    try:
+        return len(value)
+    except TypeError:
+        return None
+
+
+# Lazy placeholders are looked at through the class dict, so inspecting
+# a target never materializes it.
+def get_target_value(touched_target):
+    value = vars(touched_target.owner).get(touched_target.attr_name)
+    if isinstance(value, LazyInjectedAttribute):
+        return value.original_value, True
+    return touched_target.get_value(), False
+
+
+# Yields (index or key, item) for one page of a container, reading it
+# in place with islice, so paging through a big target never copies it.
+def iter_target_page(value, offset, limit):
+    if hasattr(value, 'items'):
+        return itertools.islice(value.items(), offset, offset + limit)
+    return itertools.islice(enumerate(value), offset, offset + limit)
+
+
+def _key_matches(key, key_str):
+    if str(key) == key_str:
+        return True
+    if getattr(key, '__name__', None) == key_str:
+        return True
+    # Enum members (ex: a Tag or TraitType key) by their name.
+    if getattr(key, 'name', None) == key_str:
+        return True
+    return str(getattr(key, 'guid64', '')) == key_str
+
+
+# Finds one entry by key (mapping key, or index for sequences). Keys can be given
+# by str, tuning name or guid64, since console args only come through as strings.
+# A sequence is also searched for an item matching the key, for sets of references,
+# and for numeric keys that aren't a valid index (ex: a guid64 in CLUB_TRAITS).
+def find_target_entry(value, key_str):
+    if hasattr(value, 'items'):
+        for key, item in value.items():
+            if _key_matches(key, key_str):
+                return key, item
+        return None
+    if isinstance(value, (tuple, list)) and key_str.lstrip('-').isdigit():
+        index = int(key_str)
+        if -len(value) <= index < len(value):
+            return index, value[index]
+    for index, item in enumerate(value):
+        if _key_matches(item, key_str):
+            return index, item
+    return None
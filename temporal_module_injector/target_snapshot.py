@@ -0,0 +1,94 @@
+import hashlib
+import os
+import traceback
+import sims4.log
+
+from temporal_module_injector import settings
+from temporal_module_injector.content_fingerprint import get_canonical_value
+from temporal_module_injector.output_paths import get_output_path
+from temporal_module_injector.touched_targets import touched_targets
+
+logger = sims4.log.Logger('TemporalModuleInjector')
+
+SNAPSHOT_FILE_NAME = 'TMI_target_snapshot.txt'
+BASELINE_FILE_NAME = 'TMI_target_snapshot_baseline.txt'
+
+
+# Stable, order-aware hash of a target's value. Sequences and mappings keep
+# their order, so an insertion landing somewhere else after a patch (ex: in
+# ENSEMBLE_PRIORITIES or BUCKET_SCORING_RULES) changes the hash. Only sets,
+# which have no order, are sorted.
+def get_target_hash(value):
+    return hashlib.blake2b(repr(get_canonical_value(value, ordered=True)).encode('utf-8'), digest_size=16).hexdigest()
+
+
+# Label -> hash of every target TMI touched, in label order. Reading a target
+# materializes it if it's a lazy placeholder.
+def take_snapshot():
+    snapshot = {}
+    for touched_target in touched_targets:
+        try:
+            snapshot[touched_target.label] = get_target_hash(touched_target.get_value())
+        except:
+            logger.error('Exception occurred hashing target {}', touched_target.label)
+            logger.error(traceback.format_exc())
+    return dict(sorted(snapshot.items()))
+
+
+# One 'label<tab>hash' line per target, so snapshots diff cleanly as text too.
+def write_snapshot(snapshot, file_name=SNAPSHOT_FILE_NAME):
+    snapshot_path = get_output_path(file_name)
+    with open(snapshot_path, 'w', encoding='utf-8') as snapshot_file:
+        for label, target_hash in snapshot.items():
+            snapshot_file.write('{}\t{}\n'.format(label, target_hash))
+    return snapshot_path
+
+
+def read_snapshot(file_name=BASELINE_FILE_NAME):
+    snapshot_path = get_output_path(file_name)
+    if not os.path.isfile(snapshot_path):
+        return None
+    snapshot = {}
+    with open(snapshot_path, 'r', encoding='utf-8') as snapshot_file:
+        for line in snapshot_file:
+            label, _, target_hash = line.rstrip('\n').rpartition('\t')
+            if label:
+                snapshot[label] = target_hash
+    return snapshot
+
+
+# Returns (changed, added, missing) target labels, with added/missing
+# being targets only in the current snapshot/only in the baseline.
+def compare_snapshots(baseline, snapshot):
+    changed = [label for label, target_hash in snapshot.items() if baseline.get(label, target_hash) != target_hash]
+    added = [label for label in snapshot if label not in baseline]
+    missing = [label for label in baseline if label not in snapshot]
+    return changed, added, missing
+
+
+def get_comparison_lines(baseline, snapshot):
+    changed, added, missing = compare_snapshots(baseline, snapshot)
+    lines = ['Target snapshot: {} changed, {} added, {} missing out of {} targets'.format(
+        len(changed),
+        len(added),
+        len(missing),
+        len(snapshot)
+    )]
+    lines.extend('  changed: {}'.format(label) for label in changed)
+    lines.extend('  added: {}'.format(label) for label in added)
+    lines.extend('  missing: {}'.format(label) for label in missing)
+    return lines
+
+
+def write_and_compare():
+    snapshot = take_snapshot()
+    snapshot_path = write_snapshot(snapshot)
+    logger.info('Wrote {} target hashes to {}', len(snapshot), snapshot_path)
+    if not settings.TARGET_SNAPSHOT_COMPARE_ON:
+        return
+    baseline = read_snapshot()
+    if baseline is None:
+        logger.info('No target snapshot baseline found ({}), skipping comparison', BASELINE_FILE_NAME)
+        return
+    for line in get_comparison_lines(baseline, snapshot):
+        logger.info(line)
@@ -0,0 +1,66 @@
+import contextlib
+import functools
+
+
+class TouchedTarget:
+    __slots__ = ('owner', 'attr_name', 'label', 'snippet_names')
+
+    def __init__(self, owner, attr_name, label):
+        self.owner = owner
+        self.attr_name = attr_name
+        self.label = label
+        # Ordered set of the snippets (or plans) that injected into the target.
+        self.snippet_names = {}
+
+    def get_value(self):
+        return getattr(self.owner, self.attr_name)
+
+
+# Every target (module attr or tuning ref attr) TMI has injected into, with the
+# snippets that contributed to it. Add to tuning records targets as it resolves
+# them, and the snippet currently being applied is set around each snippet.
+class TouchedTargetRegistry:
+    def __init__(self):
+        self._targets = {}
+        self._targets_by_label = {}
+        self._current_snippet_name = None
+
+    def __len__(self):
+        return len(self._targets)
+
+    def __iter__(self):
+        return iter(self._targets.values())
+
+    @contextlib.contextmanager
+    def applying_snippet(self, snippet_name):
+        previous_snippet_name = self._current_snippet_name
+        self._current_snippet_name = snippet_name
+        try:
+            yield
+        finally:
+            self._current_snippet_name = previous_snippet_name
+
+    # For injections that run later (ex: deferred), so they're still
+    # credited to the snippet that queued them.
+    def bind_snippet(self, snippet_name, apply):
+        @functools.wraps(apply)
+        def bound_apply(*args, **kwargs):
+            with self.applying_snippet(snippet_name):
+                return apply(*args, **kwargs)
+        return bound_apply
+
+    def record(self, owner, attr_name, label):
+        touched_target = self._targets.get((owner, attr_name))
+        if touched_target is None:
+            touched_target = TouchedTarget(owner, attr_name, label)
+            self._targets[(owner, attr_name)] = touched_target
+            self._targets_by_label[label] = touched_target
+        if self._current_snippet_name is not None:
+            touched_target.snippet_names[self._current_snippet_name] = None
+        return touched_target
+
+    def get_by_label(self, label):
+        return self._targets_by_label.get(label)
+
+
+touched_targets = TouchedTargetRegistry()
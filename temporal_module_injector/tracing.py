@@ -0,0 +1,86 @@
+import contextlib
+import json
+import os
+import threading
+import time
+import traceback
+import sims4.log
+
+from temporal_module_injector import settings
+from temporal_module_injector.output_paths import get_output_path
+
+logger = sims4.log.Logger('TemporalModuleInjector')
+
+TRACE_FILE_NAME = 'TMI_injection_trace.json'
+
+# Complete ('X') trace events, in the Chrome trace event format. Spans nest by
+# time on the same thread, so the viewer shows snippet callbacks containing
+# their target resolutions, merges and clones, with gaps between snippets visible.
+_events = []
+
+
+def get_size(container):
+    try:
+        return len(container)
+    except TypeError:
+        return None
+
+
+# Span used for every trace_span while tracing is off. It's shared and does
+# nothing, so an untraced span costs one flag check and no allocations.
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+# Yields the span's args dict, so callers can add args and results (ex: the merged
+# size) before the span closes. With tracing off it yields None instead, callers
+# check for that before computing anything for the args, so nothing is computed
+# for a span that isn't recorded.
+def trace_span(name, category):
+    if not settings.TRACE_ON:
+        return _NULL_SPAN
+    return _trace_span(name, category)
+
+
+@contextlib.contextmanager
+def _trace_span(name, category):
+    args = {}
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        end = time.perf_counter()
+        _events.append({
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': start * 1000000,
+            'dur': (end - start) * 1000000,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': args
+        })
+
+
+# Rewrites the whole trace each time, so the file after deferred injections
+# finish has the load spans as well.
+def dump_trace():
+    if not _events:
+        return
+    try:
+        trace_path = get_output_path(TRACE_FILE_NAME)
+        with open(trace_path, 'w', encoding='utf-8') as trace_file:
+            json.dump({'traceEvents': _events, 'displayTimeUnit': 'ms'}, trace_file, default=str)
+        logger.info('Wrote {} trace events to {}', len(_events), trace_path)
+    except:
+        logger.error('Exception occurred writing TemporalModuleInjector trace')
+        logger.error(traceback.format_exc())
@@ -0,0 +1,75 @@
+import services
+import sims4.log
+from sims4.resources import Types
+
+logger = sims4.log.Logger('TemporalModuleInjector')
+
+
+# Index of tuning instances by some key (ex: affordances by tag), built
+# in a single pass over an instance manager the first time it's asked for.
+# Selector targets in the snippet tuning share these module-level indexes,
+# so one snippet asking for 'all affordances with tag X' and another asking
+# for tag Y only ever cost one scan of the affordance manager between them.
+class TuningInstanceIndex:
+    __slots__ = ('_instance_type', '_key_getter', '_index')
+
+    def __init__(self, instance_type, key_getter):
+        self._instance_type = instance_type
+        self._key_getter = key_getter
+        self._index = None
+
+    def _build(self):
+        index = {}
+        manager = services.get_instance_manager(self._instance_type)
+        for tuning in manager.types.values():
+            for key in self._key_getter(tuning):
+                index.setdefault(key, []).append(tuning)
+        self._index = {key: tuple(tunings) for key, tunings in index.items()}
+        logger.info(
+            '  Built {} index: {} keys over {} instances',
+            self._instance_type,
+            len(self._index),
+            len(manager.types)
+        )
+
+    def get(self, key):
+        if self._index is None:
+            self._build()
+        return self._index.get(key, ())
+
+    def select(self, keys):
+        # Union of every key's tunings, keeping first-seen order
+        # so the injection order stays predictable between loads.
+        selected = {}
+        for key in keys:
+            for tuning in self.get(key):
+                selected[tuning] = None
+        return tuple(selected)
+
+    def clear(self):
+        self._index = None
+
+
+def _get_affordance_tags(affordance):
+    return getattr(affordance, 'interaction_category_tags', None) or ()
+
+
+def _get_buff_mood(buff):
+    mood = getattr(buff, 'mood_type', None)
+    return () if mood is None else (mood,)
+
+
+def _get_trait_type(trait):
+    trait_type = getattr(trait, 'trait_type', None)
+    return () if trait_type is None else (trait_type,)
+
+
+AFFORDANCES_BY_TAG = TuningInstanceIndex(Types.INTERACTION, _get_affordance_tags)
+BUFFS_BY_MOOD = TuningInstanceIndex(Types.BUFF, _get_buff_mood)
+TRAITS_BY_TYPE = TuningInstanceIndex(Types.TRAIT, _get_trait_type)
+
+
+def clear_indexes():
+    AFFORDANCES_BY_TAG.clear()
+    BUFFS_BY_MOOD.clear()
+    TRAITS_BY_TYPE.clear()
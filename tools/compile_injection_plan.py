@@ -0,0 +1,191 @@
+"""Offline compiler from TemporalModuleInjector snippet XML to a binary injection plan.
+
+Reads every TMI snippet XML file in a directory and writes the entries that can
+be expressed as plain arrays of instance ids (flat lists of tuning references,
+optionally injected into a list of target tunings) into one .tmiplan file. See
+temporal_module_injector/injection_plan_format.py for the layout.
+
+    python tools/compile_injection_plan.py <input_dir> <output.tmiplan>
+
+The snippet XML stays the source of truth. Entries that can't go in a plan
+(mappings, tuples of tunables, selector targets, etc.) are listed in the output
+and have to keep shipping as snippet XML. Snippets that were compiled in full
+should be left out of the package that ships the plan, or they'd be processed twice.
+Plans are loaded from the folder TMI's .ts4script is installed in (or from
+settings.INJECTION_PLAN_DIR), and always at load complete, so variants whose
+timing defaults to DEFERRED are not compiled.
+"""
+import argparse
+import ast
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from merge_tmi_snippets import read_entries, parse_package_module, read_list_item_variant_names  # noqa: E402
+from temporal_module_injector.injection_plan_format import PlanRecord, write_plan, KIND_MODULE_PATH, \
+    KIND_TUNING_REF_ATTR  # noqa: E402
+
+# Base variant class -> (container kind tag, locked arg holding the target path or attr)
+PLAN_VARIANT_BASES = {
+    'ModuleVariantBase': (KIND_MODULE_PATH, 'injection_target_str'),
+    'TuningRefVariantBase': (KIND_TUNING_REF_ATTR, 'injection_target_attr_str'),
+}
+TARGET_TUNING_LIST = 'target_tuning_list'
+
+
+# Enum values (ex: InjectionTiming.CRITICAL) are read as their name.
+def _read_value(node):
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    return ast.literal_eval(node)
+
+
+# The default of a tunable declared as ex: TunableInjectionTiming(default=InjectionTiming.DEFERRED).
+def _read_tunable_default(node):
+    if isinstance(node, ast.Call):
+        for keyword in node.keywords:
+            if keyword.arg == 'default':
+                return _read_value(keyword.value)
+    return None
+
+
+# class name -> (base class names, class attrs set to a resource type plus the injection_timing
+# default, locked_args)
+def _read_variant_classes():
+    variant_classes = {}
+    for node in parse_package_module('factory_variants.py').body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        type_attrs = {}
+        locked_args = {}
+        for statement in node.body:
+            if not isinstance(statement, ast.Assign) or len(statement.targets) != 1 \
+                    or not isinstance(statement.targets[0], ast.Name):
+                continue
+            attr_name = statement.targets[0].id
+            if attr_name in ('PLAN_ITEM_TYPE', 'TARGET_INSTANCE_TYPE') and isinstance(statement.value, ast.Attribute):
+                # Types.TRAIT -> 'TRAIT'
+                type_attrs[attr_name] = statement.value.attr
+            elif attr_name == 'FACTORY_TUNABLES' and isinstance(statement.value, ast.Dict):
+                for key, value in zip(statement.value.keys, statement.value.values):
+                    key = None if key is None else ast.literal_eval(key)
+                    if key == 'locked_args':
+                        locked_args = {
+                            ast.literal_eval(arg_name): _read_value(arg_value)
+                            for arg_name, arg_value in zip(value.keys, value.values)
+                        }
+                    elif key == 'injection_timing':
+                        type_attrs['INJECTION_TIMING'] = _read_tunable_default(value) or 'CRITICAL'
+        bases = tuple(base.id for base in node.bases if isinstance(base, ast.Name))
+        variant_classes[node.name] = (bases, type_attrs, locked_args)
+    return variant_classes
+
+
+# Walks the base classes, with values set in a derived class winning over those in its bases.
+def _resolve_variant_class(class_name, variant_classes):
+    if class_name in PLAN_VARIANT_BASES:
+        return class_name, {}, {}
+    if class_name not in variant_classes:
+        return None, {}, {}
+    bases, type_attrs, locked_args = variant_classes[class_name]
+    base_name = None
+    resolved_type_attrs = {}
+    resolved_locked_args = {}
+    for base in bases:
+        found_base_name, base_type_attrs, base_locked_args = _resolve_variant_class(base, variant_classes)
+        base_name = base_name or found_base_name
+        resolved_type_attrs.update(base_type_attrs)
+        resolved_locked_args.update(base_locked_args)
+    resolved_type_attrs.update(type_attrs)
+    resolved_locked_args.update(locked_args)
+    return base_name, resolved_type_attrs, resolved_locked_args
+
+
+# xml variant name -> (container kind tag, target path or attr, item resource type, target resource type)
+# Built from the factory variant classes that set PLAN_ITEM_TYPE, so it can't drift from them.
+# Plans are applied once snippets finish loading, so variants that default to DEFERRED
+# timing (ex: club_seeds_secondary) are left out and keep shipping as snippet XML.
+def get_plan_variants():
+    variant_classes = _read_variant_classes()
+    plan_variants = {}
+    for variant_name, class_name in read_list_item_variant_names().items():
+        base_name, type_attrs, locked_args = _resolve_variant_class(class_name, variant_classes)
+        if base_name is None or 'PLAN_ITEM_TYPE' not in type_attrs or not locked_args.get('is_xml_usable_variant'):
+            continue
+        if locked_args.get('injection_timing', type_attrs.get('INJECTION_TIMING')) == 'DEFERRED':
+            continue
+        kind, target_arg = PLAN_VARIANT_BASES[base_name]
+        if not locked_args.get(target_arg):
+            continue
+        plan_variants[variant_name] = (
+            kind,
+            locked_args[target_arg],
+            type_attrs['PLAN_ITEM_TYPE'],
+            type_attrs.get('TARGET_INSTANCE_TYPE')
+        )
+    return plan_variants
+
+
+def _get_ids(list_element):
+    return [int(item.text.strip()) for item in list_element if isinstance(item.tag, str) and item.tag == 'T']
+
+
+def compile_records(merged_entries):
+    plan_variants = get_plan_variants()
+    records = {}
+    skipped = []
+    for entry in merged_entries.values():
+        if entry.section != 'add_items_to_list':
+            skipped.append(entry)
+            continue
+        plan_variant = plan_variants.get(entry.variant)
+        options = {option.get('n'): option for option in entry.options}
+        if plan_variant is None or set(options) - {TARGET_TUNING_LIST}:
+            skipped.append(entry)
+            continue
+        kind, target, item_type, target_type = plan_variant
+        target_ids = ()
+        if target_type is not None:
+            if TARGET_TUNING_LIST not in options:
+                skipped.append(entry)
+                continue
+            target_ids = tuple(_get_ids(options[TARGET_TUNING_LIST]))
+        record = records.get((target, target_ids))
+        if record is None:
+            record = PlanRecord(target, kind, item_type, target_type, target_ids, {})
+            records[(target, target_ids)] = record
+        for item in entry.items.values():
+            if item.tag == 'T':
+                record.item_ids[int(item.text.strip())] = None
+    for record in records.values():
+        record.item_ids = tuple(record.item_ids)
+    return list(records.values()), skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compile TemporalModuleInjector snippet XML into an injection plan.')
+    parser.add_argument('input_dir')
+    parser.add_argument('output_file')
+    args = parser.parse_args(argv)
+
+    merged_entries = {}
+    stats = {'snippets': 0, 'entries': 0}
+    read_entries(args.input_dir, merged_entries, stats)
+    records, skipped = compile_records(merged_entries)
+    with open(args.output_file, 'wb') as plan_file:
+        write_plan(records, plan_file)
+
+    print('Compiled {} record(s) with {} item id(s) from {} snippet(s) into {}'.format(
+        len(records),
+        sum(len(record.item_ids) for record in records),
+        stats['snippets'],
+        args.output_file
+    ))
+    for entry in skipped:
+        print('  Not plan compatible, keep as snippet XML: {} ({})'.format(entry.variant, entry.section))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
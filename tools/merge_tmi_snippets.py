@@ -0,0 +1,357 @@
+"""Offline merger for TemporalModuleInjector snippet tuning.
+
+Reads every TMI snippet XML file in a directory, groups their entries by
+section, variant and target, removes duplicate items and writes the result
+back out as one combined snippet (or a few, with --max-entries). Each TMI
+snippet is a separate tuning instance with its own trip through the snippet
+manager and its own _tuning_loaded_callback, so release builds with lots of
+small snippets load faster merged.
+
+This runs outside the game with a plain Python 3 install:
+
+    python tools/merge_tmi_snippets.py <input_dir> <output_dir> --creator Triplis
+
+Items are compared with their XML comments stripped. List items are kept in
+first-seen order. With the default REPLACE merge_mode, mapping items are merged
+by key with the last one winning, the same way TMI replaces a mapping value.
+With DEEP_MERGE, TMI merges every value for a key into the target in turn, so
+each different value for a key already taken is kept, in its own entry after the
+ones before it, rather than combined here. Which variants are mappings, and what
+their key is called in the XML, is read from factory_variants.py.
+"""
+import argparse
+import ast
+import os
+import sys
+import xml.etree.ElementTree as ET
+
+SNIPPET_CLASS = 'TemporalModuleInjector'
+SNIPPET_MODULE = 'temporal_module_injector.snippet_tuning_class'
+SNIPPET_TYPE = 0x7DF2169C
+# Section -> name of the variant field holding the items to merge. Replace entries
+# pair two variants positionally, so they're only de-duplicated as a whole.
+SECTIONS = {
+    'add_items_to_list': 'new_items',
+    'add_items_to_existing_list_item': 'new_items',
+    'remove_items_from_list': 'removed_items',
+    'replace_items_in_list': None,
+}
+# Sections whose variants come from snippet_tuning_class._list_item_variants
+LIST_ITEM_VARIANT_SECTIONS = ('add_items_to_list', 'remove_items_from_list')
+ITEM_LIST = 'item_list'
+MERGE_MODE = 'merge_mode'
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'temporal_module_injector')
+
+FNV64_OFFSET = 0xCBF29CE484222325
+FNV64_PRIME = 0x100000001B3
+FNV64_MASK = 0xFFFFFFFFFFFFFFFF
+
+
+# Same FNV-1 64 bit hash (with the high bit set, for custom content) that
+# the usual tuning tools use to make instance ids from tuning names.
+def get_instance_id(name):
+    value = FNV64_OFFSET
+    for byte in name.lower().encode('utf-8'):
+        value = (value * FNV64_PRIME) & FNV64_MASK
+        value ^= byte
+    return value | 0x8000000000000000
+
+
+def _parse(path):
+    # Comments are kept so merged items still read like 'Trait: trait_HotHeaded',
+    # and leading whitespace is dropped since some tools write a blank first line.
+    parser = ET.XMLParser(target=ET.TreeBuilder(insert_comments=True))
+    with open(path, 'rb') as xml_file:
+        parser.feed(xml_file.read().lstrip())
+    return parser.close()
+
+
+# Comment free, attribute ordered form of an element,
+# used to compare items and targets between snippets.
+def canonical(element, sort_children=False):
+    children = [canonical(child, sort_children) for child in element if child.tag is not ET.Comment]
+    if sort_children:
+        children.sort()
+    return (element.tag, tuple(sorted(element.attrib.items())), (element.text or '').strip(), tuple(children))
+
+
+# The package modules import game modules, so they're read with ast instead of imported.
+def parse_package_module(file_name):
+    with open(os.path.join(PACKAGE_DIR, file_name), encoding='utf-8') as module_file:
+        return ast.parse(module_file.read(), file_name)
+
+
+# xml variant name -> factory variant class name, from snippet_tuning_class._list_item_variants
+def read_list_item_variant_names():
+    for node in parse_package_module('snippet_tuning_class.py').body:
+        if isinstance(node, ast.FunctionDef) and node.name == '_list_item_variants':
+            variant_call = node.body[0].value
+            return {keyword.arg: keyword.value.func.value.attr for keyword in variant_call.keywords}
+    return {}
+
+
+def _get_call_name(node):
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+        return node.func.id
+    return None
+
+
+# Follows item_list through helpers that build it (ex: get_instance_target_tunable
+# with a fallback factory), and returns the name of the tunable and its key_name.
+def _get_item_list_tunable(node, functions):
+    call_name = _get_call_name(node)
+    if call_name == 'get_instance_target_tunable':
+        return _get_item_list_tunable(ast.Call(func=node.args[2], args=[], keywords=[]), functions)
+    if call_name in functions:
+        return _get_item_list_tunable(functions[call_name].body[-1].value, functions)
+    key_name = None
+    if call_name == 'TunableMapping':
+        key_name = 'key'
+        for keyword in node.keywords:
+            if keyword.arg == 'key_name':
+                key_name = ast.literal_eval(keyword.value)
+    return call_name, key_name
+
+
+# xml variant name -> name of the key element in its mapping items (ex: 'Baby'),
+# for the _list_item_variants whose item_list is a TunableMapping.
+def get_mapping_key_names():
+    functions = {}
+    bases = {}
+    item_list_tunables = {}
+    for node in parse_package_module('factory_variants.py').body:
+        if isinstance(node, ast.FunctionDef):
+            functions[node.name] = node
+        elif isinstance(node, ast.ClassDef):
+            bases[node.name] = [base.id for base in node.bases if isinstance(base, ast.Name)]
+            for statement in node.body:
+                if isinstance(statement, ast.Assign) and isinstance(statement.value, ast.Dict) \
+                        and any(isinstance(target, ast.Name) and target.id == 'FACTORY_TUNABLES'
+                                for target in statement.targets):
+                    for key, value in zip(statement.value.keys, statement.value.values):
+                        if key is not None and ast.literal_eval(key) == ITEM_LIST:
+                            item_list_tunables[node.name] = value
+    key_names = {}
+    for variant_name, class_name in read_list_item_variant_names().items():
+        # item_list may be defined in a base class (ex: Lifestyles)
+        while class_name is not None and class_name not in item_list_tunables:
+            class_name = next(iter(bases.get(class_name, ())), None)
+        if class_name is None:
+            continue
+        _, key_name = _get_item_list_tunable(item_list_tunables[class_name], functions)
+        if key_name is not None:
+            key_names[variant_name] = key_name
+    return key_names
+
+
+def _get_item_key(item, key_name):
+    if key_name is None:
+        return None
+    for child in item:
+        if child.tag is not ET.Comment and child.get('n') == key_name:
+            return canonical(child)
+    return None
+
+
+class PassThroughEntry:
+    def __init__(self, section, entry):
+        self.section = section
+        self.variant = entry.find('V').get('t') if entry.find('V') is not None else ''
+        self.entry = entry
+        self.duplicate_count = 0
+
+    def to_element(self):
+        return self.entry
+
+
+class MergedEntry:
+    def __init__(self, section, variant, options, key_name=None):
+        self.section = section
+        self.variant = variant
+        self.options = options
+        self.key_name = key_name
+        self.is_deep_merge = any(
+            option.get('n') == MERGE_MODE and (option.text or '').strip() == 'DEEP_MERGE' for option in options
+        )
+        self.items = {}
+        self.duplicate_count = 0
+        self.variant_field = SECTIONS[section]
+
+    # Returns the deep merged mapping items whose key this entry already has with
+    # a different value, for the caller to add to a later entry.
+    def add_items(self, item_list):
+        conflicts = []
+        for item in item_list:
+            if item.tag is ET.Comment:
+                continue
+            key = _get_item_key(item, self.key_name)
+            if key is None:
+                key = canonical(item)
+                if key in self.items:
+                    self.duplicate_count += 1
+                    continue
+            elif key in self.items:
+                if self.is_deep_merge:
+                    if canonical(item) == canonical(self.items[key]):
+                        self.duplicate_count += 1
+                    else:
+                        conflicts.append(item)
+                    continue
+                # Mapping key seen before, last one wins like in a dict merge,
+                # but it keeps its first-seen position.
+                self.duplicate_count += 1
+            self.items[key] = item
+        return conflicts
+
+    def to_element(self):
+        entry = ET.Element('U')
+        new_items = ET.SubElement(entry, 'V', n=self.variant_field, t=self.variant)
+        variant = ET.SubElement(new_items, 'U', n=self.variant)
+        for option in self.options:
+            variant.append(option)
+        item_list = ET.SubElement(variant, 'L', n=ITEM_LIST)
+        for item in self.items.values():
+            item_list.append(item)
+        return entry
+
+
+def read_entries(input_dir, merged_entries, stats):
+    mapping_key_names = get_mapping_key_names()
+    for file_name in sorted(os.listdir(input_dir)):
+        if not file_name.lower().endswith('.xml'):
+            continue
+        root = _parse(os.path.join(input_dir, file_name))
+        if root.tag != 'I' or root.get('c') != SNIPPET_CLASS:
+            continue
+        stats['snippets'] += 1
+        for section in root:
+            if section.tag is ET.Comment or section.get('n') not in SECTIONS:
+                continue
+            for entry in section:
+                if entry.tag is ET.Comment:
+                    continue
+                variant_field = SECTIONS[section.get('n')]
+                if variant_field is None:
+                    stats['entries'] += 1
+                    group_key = (section.get('n'), canonical(entry, sort_children=True))
+                    if group_key in merged_entries:
+                        merged_entries[group_key].duplicate_count += 1
+                    else:
+                        merged_entries[group_key] = PassThroughEntry(section.get('n'), entry)
+                    continue
+                new_items = entry.find("V[@n='{}']".format(variant_field))
+                if new_items is None:
+                    continue
+                variant_name = new_items.get('t')
+                variant = new_items.find("U[@n='{}']".format(variant_name))
+                if variant is None:
+                    continue
+                stats['entries'] += 1
+                options = [child for child in variant if child.tag is not ET.Comment and child.get('n') != ITEM_LIST]
+                item_list = variant.find("L[@n='{}']".format(ITEM_LIST))
+                # Everything but the items (targets, selectors, key_ref, etc.)
+                # decides which entries can share one merged entry.
+                group_key = (
+                    section.get('n'),
+                    variant_name,
+                    tuple(sorted(canonical(option, sort_children=True) for option in options))
+                )
+                key_name = None
+                if section.get('n') in LIST_ITEM_VARIANT_SECTIONS:
+                    key_name = mapping_key_names.get(variant_name)
+                # Deep merged values for a key that's already taken go to the next
+                # entry in the group, so each is merged in after the ones before it.
+                items = list(item_list) if item_list is not None else []
+                layer = 0
+                while True:
+                    merged = merged_entries.get(group_key + (layer,))
+                    if merged is None:
+                        merged = MergedEntry(section.get('n'), variant_name, options, key_name)
+                        merged_entries[group_key + (layer,)] = merged
+                    items = merged.add_items(items)
+                    if not items:
+                        break
+                    layer += 1
+
+
+def build_snippet(name, entries):
+    root = ET.Element('I', c=SNIPPET_CLASS, i='snippet', m=SNIPPET_MODULE, n=name, s=str(get_instance_id(name)))
+    for section in SECTIONS:
+        section_entries = [entry for entry in entries if entry.section == section]
+        if section_entries:
+            section_element = ET.SubElement(root, 'L', n=section)
+            for entry in section_entries:
+                section_element.append(entry.to_element())
+    return root
+
+
+# Like ET.indent, but leaves value elements alone so that a reference
+# and its comment stay on one line (ex: <T>16845<!--Trait: trait_HotHeaded--></T>).
+def _indent(element, level=0):
+    children = [child for child in element if child.tag is not ET.Comment]
+    if not children:
+        return
+    element.text = '\n' + '  ' * (level + 1)
+    for child in children:
+        _indent(child, level + 1)
+        child.tail = '\n' + '  ' * (level + 1)
+    children[-1].tail = '\n' + '  ' * level
+
+
+def write_snippet(output_dir, root):
+    name = root.get('n')
+    file_name = 'S4_{:08X}_00000000_{:016X}_{}.xml'.format(
+        SNIPPET_TYPE,
+        int(root.get('s')),
+        name.replace(':', '_')
+    )
+    _indent(root)
+    with open(os.path.join(output_dir, file_name), 'wb') as output_file:
+        output_file.write(b'<?xml version="1.0" encoding="utf-8"?>\n')
+        output_file.write(ET.tostring(root, encoding='utf-8'))
+    return file_name
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Merge TemporalModuleInjector snippet XML files.')
+    parser.add_argument('input_dir')
+    parser.add_argument('output_dir')
+    parser.add_argument('--creator', required=True, help='Creator prefix for the merged tuning names.')
+    parser.add_argument('--name', default='TemporalModuleInjector_Merged', help='Base name of the merged snippets.')
+    parser.add_argument(
+        '--max-entries',
+        type=int,
+        default=0,
+        help='Split the output into snippets of at most this many entries (default: one snippet).'
+    )
+    args = parser.parse_args(argv)
+
+    merged_entries = {}
+    stats = {'snippets': 0, 'entries': 0}
+    read_entries(args.input_dir, merged_entries, stats)
+    entries = list(merged_entries.values())
+    if not entries:
+        print('No {} snippets found in {}'.format(SNIPPET_CLASS, args.input_dir))
+        return 1
+
+    chunk_size = args.max_entries if args.max_entries > 0 else len(entries)
+    chunks = [entries[index:index + chunk_size] for index in range(0, len(entries), chunk_size)]
+    os.makedirs(args.output_dir, exist_ok=True)
+    for chunk_index, chunk in enumerate(chunks):
+        name = '{}:{}'.format(args.creator, args.name)
+        if len(chunks) > 1:
+            name = '{}_{}'.format(name, chunk_index + 1)
+        print('Wrote {}'.format(write_snippet(args.output_dir, build_snippet(name, chunk))))
+
+    print('Merged {} snippet(s) with {} entries into {} snippet(s) with {} entries, {} duplicate(s) removed'.format(
+        stats['snippets'],
+        stats['entries'],
+        len(chunks),
+        len(entries),
+        sum(entry.duplicate_count for entry in entries)
+    ))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())